@@ -0,0 +1,272 @@
+
+## Imports
+import config
+import tempfile
+import argparse
+import platform
+import json
+import sys
+
+# Run everything offline in a temporary folder (must be done before importing the application modules)
+TEMP_FOLDER: str = tempfile.mkdtemp(prefix = "autoreport_benchmark_").replace("\\", "/")
+config.TRANSCRIPT_FOLDER = f"{TEMP_FOLDER}/transcripts"
+config.AUDIO_FOLDER = f"{TEMP_FOLDER}/audio"
+config.OUTPUT_FOLDER = f"{TEMP_FOLDER}/output"
+config.SPEECH_BACKEND = "fake"
+config.DEBUG_MODE = False
+config.LOG_LEVEL = "info"			# Computed from DEBUG_MODE when the configuration is imported
+config.KEEP_AUDIO_FILES = False
+config.TRANSCRIPT_CACHE = False
+
+from config import *
+from src.print import *
+from src.silence import is_silent, is_silent_wav_bytes
+from src.segmenter import Segmenter
+from src.resampler import Resampler
+from src.manifest import TRANSCRIBED, SegmentManifest, get_manifest
+from src.transcript_utils import make_the_big_transcript, close_the_big_transcript, transcribe_segment, save_transcript
+from src.transcription_queue import TranscriptionQueue
+from collections.abc import Callable
+import statistics
+import shutil
+import wave
+import io
+import numpy as np
+
+
+# Function to generate synthetic speech
+def synthetic_speech(duration: float, rate: int = ANALYSIS_RATE, speech: float = 2.0, silence: float = 0.8, seed: int = 0) -> bytes:
+	""" Generate alternating bursts of voiced sound and background noise\n
+	Args:
+		duration	(float):	Duration of the audio (in seconds)
+		rate		(int):		Sample rate (Hz)
+		speech		(float):	Average duration of the voiced bursts (in seconds)
+		silence		(float):	Average duration of the pauses (in seconds)
+		seed		(int):		Seed of the random generator
+	Returns:
+		bytes: Audio data (16-bit mono PCM)
+	"""
+	generator: np.random.Generator = np.random.default_rng(seed)
+	samples: np.ndarray = generator.normal(0, 30, int(duration * rate))		# Background noise
+	position: int = 0
+	while position < len(samples):
+		burst: int = int(generator.uniform(0.5, 1.5) * speech * rate)
+		t: np.ndarray = np.arange(min(burst, len(samples) - position)) / rate
+		pitch: float = generator.uniform(90, 220)
+		voice: np.ndarray = sum(np.sin(2 * np.pi * pitch * k * t) / k for k in range(1, 6))
+		samples[position:position + len(t)] += 3000 * voice * (0.6 + 0.4 * np.sin(2 * np.pi * 4 * t))	# Syllable-like modulation
+		position += burst + int(generator.uniform(0.5, 1.5) * silence * rate)
+	return np.clip(samples, -32768, 32767).astype(np.int16).tobytes()
+
+# Function to make a WAV file in memory
+def to_wav(pcm: bytes, rate: int) -> bytes:
+	with io.BytesIO() as output:
+		with wave.open(output, "wb") as wf:
+			wf.setnchannels(1)
+			wf.setsampwidth(2)
+			wf.setframerate(rate)
+			wf.writeframes(pcm)
+		return output.getvalue()
+
+
+# Function to time a function
+def measure(function: Callable[[], object], repeat: int = 5, **extra: float) -> dict[str, float]:
+	""" Run a function several times and keep its timings\n
+	Args:
+		function	(Callable):	Function to time
+		repeat		(int):		Number of runs
+		extra		(float):	Values added to the result (e.g. "audio_s" for the duration of audio processed per run)
+	Returns:
+		dict[str, float]: Best, mean and median time of a run (in seconds), and the real-time factor if "audio_s" is given
+	"""
+	times: list[float] = []
+	for _ in range(repeat):
+		start: float = time.perf_counter()
+		function()
+		times.append(time.perf_counter() - start)
+	result: dict[str, float] = {"runs": repeat, "best_s": min(times), "mean_s": statistics.mean(times), "median_s": statistics.median(times), **extra}
+	if "audio_s" in extra:
+		result["realtime_factor"] = extra["audio_s"] / max(min(times), 1e-12)
+	return result
+
+
+## Benchmarks
+def bench_silence(results: dict, duration: float) -> None:
+	""" Silence detection on raw PCM and WAV files """
+	pcm: bytes = synthetic_speech(duration, RATE)
+	wav: bytes = to_wav(pcm, RATE)
+	results["is_silent"] = measure(lambda: is_silent(pcm, SILENCE_THRESHOLD, RATE), audio_s = duration)
+	results["is_silent_wav_bytes"] = measure(lambda: is_silent_wav_bytes(wav), audio_s = duration)
+
+def bench_audio_stream(results: dict, duration: float) -> None:
+	""" Capture buffering: ring buffer writes of PortAudio-sized chunks, reads and resampling to ANALYSIS_RATE """
+	try:
+		from src.audio_stream import RingBuffer
+	except ImportError as e:
+		results["audio_stream_buffering"] = {"skipped": str(e)}
+		return
+	samples: np.ndarray = np.frombuffer(synthetic_speech(duration, RATE), np.int16)
+	chunks_per_read: int = max(1, int(SLEEP_INTERVAL * RATE) // CHUNK_SIZE)
+
+	def run() -> None:
+		ring: RingBuffer = RingBuffer(int(BUFFER_DURATION * RATE))
+		resampler: Resampler = Resampler(RATE, ANALYSIS_RATE)
+		for i, start in enumerate(range(0, len(samples), CHUNK_SIZE)):
+			ring.write(samples[start:start + CHUNK_SIZE])
+			if i % chunks_per_read == 0:
+				resampler.process(ring.read()[0])
+		resampler.process(ring.read()[0])
+	results["audio_stream_buffering"] = measure(run, audio_s = duration)
+
+def bench_resampler(results: dict, duration: float) -> None:
+	""" Resampling of the capture rate to ANALYSIS_RATE, by main loop iteration """
+	pcm: bytes = synthetic_speech(duration, RATE)
+	step: int = 2 * int(SLEEP_INTERVAL * RATE)
+
+	def run() -> None:
+		resampler: Resampler = Resampler(RATE, ANALYSIS_RATE)
+		for start in range(0, len(pcm), step):
+			resampler.process(pcm[start:start + step])
+	results["resampler"] = measure(run, audio_s = duration)
+
+def bench_segmentation(results: dict, duration: float) -> None:
+	""" Client segmentation loop: the segmenter fed every SLEEP_INTERVAL """
+	pcm: bytes = synthetic_speech(duration, ANALYSIS_RATE)
+	step: int = 2 * int(SLEEP_INTERVAL * ANALYSIS_RATE)
+	segments: list[int] = []
+
+	def run() -> None:
+		segmenter: Segmenter = Segmenter(ANALYSIS_RATE, SILENCE_THRESHOLD)
+		count: int = 0
+		for start in range(0, len(pcm), step):
+			count += len(segmenter.feed(pcm[start:start + step]))
+		segments.append(count + len(segmenter.flush()))
+	results["segmentation_loop"] = measure(run, audio_s = duration)
+	results["segmentation_loop"]["segments"] = segments[-1]
+
+# Function to convert mimeType frames to wav
+def convert_to_wav(frames: bytes, start_duration: float = 0.0, mime_type: str = "audio/webm") -> tuple[bytes, float]:
+	""" Convert the frames of mimeType to wav
+	Args:
+		frames			(bytes):	Audio frames
+		start_duration	(float):	Start duration of the audio
+		mime_type		(str):		MIME type of the audio frames
+	Returns:
+		tuple[bytes, float]:		Wav frames and the duration of the audio
+	"""
+	import pydub
+	bytes_io: io.BytesIO = io.BytesIO(frames)
+	audio: pydub.AudioSegment = pydub.AudioSegment.from_file(bytes_io, format=mime_type.split(';')[0].split('/')[-1], start_second=start_duration)
+	with io.BytesIO() as output:
+		audio.export(output, format="wav")
+		return output.getvalue(), audio.duration_seconds
+
+def bench_webm(results: dict, duration: float) -> None:
+	""" Server decoding: convert_to_wav on the growing WebM buffer (one call per chunk) against the streaming decoder """
+	try:
+		import pydub, subprocess
+		from src.stream_decoder import StreamDecoder
+		webm: bytes = subprocess.run(
+			[pydub.AudioSegment.converter, "-hide_banner", "-loglevel", "error", "-f", "s16le", "-ar", str(ANALYSIS_RATE), "-ac", "1", "-i", "pipe:0", "-c:a", "libopus", "-f", "webm", "pipe:1"],
+			input = synthetic_speech(duration, ANALYSIS_RATE), stdout = subprocess.PIPE, check = True
+		).stdout
+	except Exception as e:
+		results["convert_to_wav_growing"] = {"skipped": str(e)}
+		return
+	step: int = max(1, len(webm) // int(duration / SLEEP_INTERVAL))
+
+	def run_growing() -> None:
+		for end in range(step, len(webm) + step, step):
+			convert_to_wav(webm[:end])
+
+	def run_streaming() -> None:
+		decoder: StreamDecoder = StreamDecoder("audio/webm", ANALYSIS_RATE)
+		for start in range(0, len(webm), step):
+			decoder.feed(webm[start:start + step])
+			decoder.read()
+		decoder.finish()
+	results["convert_to_wav_growing"] = measure(run_growing, repeat = 1, audio_s = duration, chunks = len(range(0, len(webm), step)))
+	results["stream_decoder"] = measure(run_streaming, repeat = 3, audio_s = duration)
+
+def bench_big_transcript(results: dict, sizes: list[int]) -> None:
+	""" Big transcript assembly: first build with N transcripts, then one update with a single new transcript """
+	for size in sizes:
+		session: str = f"benchmark_{size}"
+
+		# Write the manifest of the transcribed segments at once (adding them one by one would sync the file twice per segment)
+		with open(f"{TRANSCRIPT_FOLDER}/manifest_{session}.jsonl", "w", encoding = "utf-8") as f:
+			for i in range(size):
+				segment: dict = {"sequence": i, "source": "recorder" if i % 3 else "playback", "name": f"segment_{i}", "start": i, "end": i + 1, "state": TRANSCRIBED, "transcript": f"sentence number {i} of the benchmark transcript"}
+				f.write(json.dumps({"event": "add", "segment": segment}) + "\n")
+		manifest: SegmentManifest = get_manifest(session)
+		results[f"big_transcript_build_{size}"] = measure(lambda: make_the_big_transcript(session), repeat = 1)
+
+		def update() -> None:
+			manifest.set_state(manifest.add("recorder", size, size + 1), TRANSCRIBED, "one more sentence")
+			make_the_big_transcript(session)
+		results[f"big_transcript_update_{size}"] = measure(update, repeat = 5)
+		close_the_big_transcript(session)
+
+def bench_transcription(results: dict, count: int) -> None:
+	""" Transcription pipeline with the fake backend: queue, recognizer call, transcript saving and merging """
+	session: str = "benchmark_transcription"
+	pcm: bytes = synthetic_speech(3.0, ANALYSIS_RATE)
+
+	def run() -> None:
+		manifest: SegmentManifest = get_manifest(session)
+		queue: TranscriptionQueue = TranscriptionQueue(transcribe_segment, save_transcript)
+		for i in range(count):
+			queue.submit(manifest.add("recorder", 3 * i, 3 * i + 3, pcm = pcm))
+		queue.shutdown()
+		make_the_big_transcript(session)
+	results["transcription_pipeline"] = measure(run, repeat = 3, audio_s = 3.0 * count)
+	close_the_big_transcript(session)
+
+
+# Main function
+def benchmark_main(args: list[str]|None = None) -> dict:
+	parser: argparse.ArgumentParser = argparse.ArgumentParser(description = "Benchmark the hot paths of the application offline (synthetic audio, fake recognizer)")
+	parser.add_argument("--output", default = "benchmark.json", help = "JSON file receiving the results (default: benchmark.json)")
+	parser.add_argument("--duration", type = float, default = 60.0, help = "Duration (in seconds) of the synthetic audio (default: 60)")
+	parser.add_argument("--quick", action = "store_true", help = "Skip the largest transcript (10k files)")
+	options: argparse.Namespace = parser.parse_args(args)
+	for folder in [TRANSCRIPT_FOLDER, AUDIO_FOLDER, OUTPUT_FOLDER]:
+		os.makedirs(folder, exist_ok = True)
+
+	# Run the benchmarks
+	results: dict = {}
+	try:
+		for name, benchmark in [
+			("silence detection", lambda: bench_silence(results, options.duration)),
+			("audio stream buffering", lambda: bench_audio_stream(results, options.duration)),
+			("resampler", lambda: bench_resampler(results, options.duration)),
+			("segmentation loop", lambda: bench_segmentation(results, options.duration)),
+			("webm decoding", lambda: bench_webm(results, min(options.duration, 30.0))),
+			("big transcript", lambda: bench_big_transcript(results, [10, 1000] if options.quick else [10, 1000, 10000])),
+			("transcription pipeline", lambda: bench_transcription(results, 200)),
+		]:
+			info(f"Benchmarking the {name}...")
+			benchmark()
+	finally:
+		shutil.rmtree(TEMP_FOLDER, ignore_errors = True)
+
+	# Save the results
+	report: dict = {
+		"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+		"python": sys.version.split()[0],
+		"numpy": np.__version__,
+		"platform": platform.platform(),
+		"config": {"RATE": RATE, "ANALYSIS_RATE": ANALYSIS_RATE, "SLEEP_INTERVAL": SLEEP_INTERVAL, "TRANSCRIPTION_WORKERS": TRANSCRIPTION_WORKERS},
+		"results": results,
+	}
+	with open(options.output, "w", encoding = "utf-8") as f:
+		json.dump(report, f, indent = 4)
+	for name, result in results.items():
+		summary: str = result["skipped"] if "skipped" in result else f"best {result['best_s'] * 1000:.2f} ms" + (f", {result['realtime_factor']:.0f}x real time" if "realtime_factor" in result else "")
+		info(f"{name}: {summary}")
+	info(f"Results saved to '{options.output}'")
+	return report
+
+if __name__ == "__main__":
+	benchmark_main()
+
@@ -10,35 +10,83 @@ KEEP_AUDIO_FILES: bool = True					# Keep generated audio files
 UPDATE_REPORT_EVERY_X_SECONDS: int = 60			# Update the report every X seconds (0 to disable: only update at the end of the transcription)
 ENABLE_PLAYBACK_DEVICE: bool = True				# Enable the playback device (if False, only the recording device will be used)
 DEBUG_MODE: bool = True							# Enable debug mode (more verbose output)
+LOG_LEVEL: str = "debug" if DEBUG_MODE else "info"	# Minimum level of the messages shown: "debug", "info", "warning" or "error"
+LOG_FILE: str = ""								# JSON lines file receiving the messages too (empty to disable), e.g. "logs/autoreport.jsonl"
+LOG_RATE_LIMIT: int = 5							# Maximum number of debug messages per second from the same line of code (the next ones are skipped and counted)
+LOG_QUEUE_SIZE: int = 10000						# Maximum number of messages waiting to be written (the next ones are dropped, logging never waits)
 DEBUG_VOLUME: bool = False						# Enable volume debug mode (show the volume of the audio data in comparison to the threshold)
+RESUME_SESSION: bool = False					# Resume the last session left in the transcripts folder (e.g. after a crash) instead of starting a new one
 MAX_WORDS_PER_LINE: int = 20					# Maximum number of words per line in the transcript
 
 # Technical configuration
 RECORDING_DEVICE_NAME: str = "microphone"		# Name of the microphone device to search for
 PLAYBACK_DEVICE_NAME: str = "casque pour"				# Name of the speakers device to search for (must have input capabilities, e.g., "Stereo Mix")
 RATE = 48000									# Sample rate (Hz)
+ANALYSIS_RATE: int = 16000						# Sample rate (Hz) of the audio analyzed and transcribed (the captured audio is resampled to it)
 CHUNK_SIZE = 1024								# Buffer size
-SILENCE_THRESHOLD: int = 400					# Threshold for silence detection (to adjust depending on ambient noise)
+CALLBACK_CAPTURE: bool = True					# Capture audio through PortAudio callbacks (False to use one blocking reader thread per device)
+BUFFER_DURATION: float = 10.0					# Maximum duration (in seconds) of unread audio kept in memory per stream
+SILENCE_THRESHOLD: int = 400					# Threshold for silence detection, RMS amplitude of a voiced frame (to adjust depending on ambient noise)
+VAD_FRAME_DURATION: float = 0.02				# Duration (in seconds) of the frames analyzed by the voice activity detection
+VAD_MAX_ZCR: float = 0.5						# Maximum zero-crossing rate of a voiced frame (noise-like frames above it are considered silent)
+VAD_MIN_VOICED_FRAMES: int = 3					# Minimum number of voiced frames for a chunk of audio not to be silent
 SILENCE_DURATION: float = 0.6					# Duration (in seconds) of the pause needed to consider a new sentence in the audio file
 MINIMUM_DURATION: float = 1.2					# Minimum duration (in seconds) of a sentence in the audio file
-MAXIMUM_DURATION: float = 30.0					# Maximum duration (in seconds) of a sentence in the audio file
+MAXIMUM_DURATION: float = 30.0					# Maximum duration (in seconds) of a sentence in the audio file (longer ones are cut at their quietest point)
+CUT_LOOKBACK: float = 3.0						# Duration (in seconds) searched backwards for the quietest point when a sentence reaches the maximum duration
+CUT_OVERLAP: float = 0.3						# Duration (in seconds) of audio repeated at the start of the next segment after a forced cut (so no word is split)
+PRE_ROLL: float = 0.3							# Duration (in seconds) of audio kept before the start of a sentence (so onsets are never clipped)
+POST_ROLL: float = 0.2							# Duration (in seconds) of audio kept after the end of a sentence
+ECHO_SUPPRESSION: bool = True					# Drop the recorder sentences that are the playback audio leaking into the microphone (speaker-phone setups)
+ECHO_MAX_DELAY: float = 0.5						# Maximum delay (in seconds) between the playback audio and its echo in the microphone
+ECHO_WINDOW: float = 1.0						# Duration (in seconds) of the windows of a recorder sentence compared with the playback audio
+ECHO_THRESHOLD: float = 0.4						# Normalized correlation (between 0 and 1) above which a window of a recorder sentence is an echo
+ECHO_DROP_RATIO: float = 0.7					# Ratio of echo windows above which a recorder sentence is dropped (below it, only the echo windows are muted)
 SLEEP_INTERVAL: float = 0.5						# Time to sleep between each iteration of the main loop (in seconds)
+TRANSCRIPTION_WORKERS: int = 4					# Number of audio files transcribed at the same time
+TRANSCRIPTION_QUEUE_SIZE: int = 64				# Maximum number of audio files waiting for a transcript (capture waits when reached)
+ARCHIVE_FORMAT: str = "flac"					# Format of the kept audio files: "wav", "flac" (lossless) or "opus" (smallest)
+ARCHIVE_BITRATE: str = "24k"					# Bitrate of the kept audio files in the opus format
+ARCHIVE_CONTAINER: str = "segment"				# "segment" to keep one audio file per sentence, "session" to append the sentences of each stream to one file
+ARCHIVE_ROLLOVER: float = 3600.0				# Duration (in seconds) of audio after which a new file is started in the "session" mode (0 to disable)
+ARCHIVE_FULL_RATE: bool = False				# Keep the audio files at the capture rate (RATE) instead of ANALYSIS_RATE
+ARCHIVE_QUEUE_SIZE: int = 64					# Maximum number of sentences waiting to be saved (the next ones are not saved, the capture never waits)
 SERVER_HOST: str = "0.0.0.0"					# Host of the server (if used)
 SERVER_PORT: int = 14444						# Port of the server (if used)
+PCM_RATE: int = 16000							# Sample rate (Hz) of the raw PCM sent by the web page in PCM capture mode (if used)
+PCM_MIN_RATE: int = 8000						# Lowest sample rate (Hz) accepted for the raw PCM of the clients
+PCM_MAX_RATE: int = 192000						# Highest sample rate (Hz) accepted for the raw PCM of the clients
+METRICS_INTERVAL: float = 30.0					# Write the latency and throughput metrics of the client to the output folder every X seconds (0 to disable)
 
 # Folders
 ROOT: str = os.path.dirname(os.path.abspath(__file__)).replace("\\", "/")	# Root folder of the application (where the py files are located)
 TRANSCRIPT_FOLDER: str = f"{ROOT}/transcripts"	# Folder where the transcripts files are stored (temporary or not depending on KEEP_TRANSCRIPTS)
 AUDIO_FOLDER: str = f"{ROOT}/audio"				# Folder where the audio files are stored (temporary or not depending on KEEP_AUDIO_FILES)
 
+# Speech recognition configuration
+SPEECH_BACKEND: str = "google"					# Speech recognition backend: "google" (online), "vosk" or "faster-whisper" (offline), "fake" (deterministic, for tests)
+VOSK_MODEL_PATH: str = f"{ROOT}/models/vosk"		# Folder of the Vosk model (if used)
+WHISPER_MODEL: str = "small"					# Name or path of the faster-whisper model (if used)
+TRANSCRIPT_CACHE: bool = True					# Reuse the transcript of audio that was already transcribed (e.g. when replaying or resuming a session)
+TRANSCRIPT_CACHE_PATH: str = f"{ROOT}/cache/transcripts.sqlite"	# SQLite database of the cached transcripts
+TRANSCRIPT_CACHE_SIZE: int = 100000				# Maximum number of cached transcripts (the least recently used ones are removed)
+
 # Configuration for the report generation
 REPORT_EXTENSION: str = "md"					# File extension of the report file (md, txt, ...)
 OUTPUT_FOLDER: str = f"{ROOT}/output"			# Folder where the reports are stored with format "report_YYYY-MM-DD_HH-MM-SS.md"
+SUMMARIZER: str = "extractive"					# Summarizer of the report: "extractive" (offline, keeps the key sentences) or "openai" (requires API keys)
+REPORT_WINDOW: float = 300.0					# Duration (in seconds) of the parts of the meeting summarized separately (each part is only summarized again if it changes)
+SUMMARY_SENTENCES: int = 3						# Maximum number of sentences of the summary of a part of the meeting
+REPORT_SENTENCES: int = 8						# Maximum number of sentences of the summary of the whole meeting
+REPORT_CACHE: bool = True						# Reuse the summaries of the parts of the meeting that were already summarized (e.g. after a restart)
+REPORT_CACHE_PATH: str = f"{ROOT}/cache/summaries.sqlite"	# SQLite database of the cached summaries
+REPORT_CACHE_SIZE: int = 10000					# Maximum number of cached summaries (the least recently used ones are removed)
 
 # OpenAI API configuration
 USE_OPENAI_API: bool = False					# Use the OpenAI API to generate the transcripts and the report (requires API keys)
 OPENAI_API_KEYS: str = f"{ROOT}/open_ai.keys"	# Path to a file containing a list of API keys to use (one per line), if the first one is exhausted, the next one will be used
 OPENAI_KEYS: list[str] = []						# List of API keys to use
+REPORT_OPENAI_MODEL: str = "gpt-4o-mini"			# Model used by the "openai" summarizer
 if USE_OPENAI_API and os.path.exists(OPENAI_API_KEYS):
 	with open(OPENAI_API_KEYS, "r") as f:
 		OPENAI_KEYS += f.read().strip().split("\n")
@@ -0,0 +1,8 @@
+
+# Import main function
+from src.replay.main import replay_main
+
+# Run the main function
+if __name__ == "__main__":
+	replay_main()
+
@@ -0,0 +1,182 @@
+
+## Imports
+from config import *
+from src.print import *
+from src.audio_utils import save_audio
+from src.metrics import metrics
+from datetime import datetime
+import subprocess
+import threading
+import queue
+import pydub
+
+# Encoders of the archive formats (ffmpeg arguments and file extension)
+ARCHIVE_CODECS: dict[str, tuple[list[str], str]] = {
+	"wav":	(["-c:a", "pcm_s16le"], "wav"),
+	"flac":	(["-c:a", "flac", "-compression_level", "8"], "flac"),
+	"opus":	(["-c:a", "libopus", "-b:a", ARCHIVE_BITRATE, "-application", "voip"], "opus"),
+}
+
+# AudioEncoder class to compress a PCM stream to a file
+class AudioEncoder:
+	def __init__(self, path: str, rate: int = RATE, archive_format: str = ARCHIVE_FORMAT):
+		""" Start an ffmpeg process encoding the PCM written to it\n
+		Args:
+			path			(str):	Path of the file to write
+			rate			(int):	Sample rate of the PCM (Hz)
+			archive_format	(str):	Format of the file (a key of ARCHIVE_CODECS)
+		"""
+		self.path: str = path
+		self.rate: int = rate
+		self.samples: int = 0		# Number of samples written
+		codec: list[str] = ARCHIVE_CODECS[archive_format][0]
+		self.process: subprocess.Popen = subprocess.Popen(
+			[pydub.AudioSegment.converter, "-hide_banner", "-loglevel", "error", "-nostdin", "-y",
+				"-f", "s16le", "-ar", str(rate), "-ac", "1", "-i", "pipe:0", *codec, path],
+			stdin = subprocess.PIPE,
+			stdout = subprocess.DEVNULL,
+			stderr = subprocess.DEVNULL,
+		)
+
+	def write(self, pcm: bytes) -> None:
+		""" Encode the given PCM (16-bit mono at self.rate) """
+		self.process.stdin.write(pcm)
+		self.samples += len(pcm) // 2
+
+	def close(self, timeout: float = 30.0) -> None:
+		""" Finish the file and wait for the encoder to exit """
+		try:
+			self.process.stdin.close()
+			if self.process.wait(timeout = timeout) != 0:
+				warning(f"Audio encoder exited with code {self.process.returncode} for '{os.path.basename(self.path)}'")
+		except Exception:
+			self.process.kill()
+
+
+# AudioArchiver class to save the audio in the background
+class AudioArchiver:
+	def __init__(self, archive_format: str = ARCHIVE_FORMAT, container: str = ARCHIVE_CONTAINER, rollover: float = ARCHIVE_ROLLOVER, max_pending: int = ARCHIVE_QUEUE_SIZE):
+		""" Start the writer thread\n
+		Args:
+			archive_format	(str):		Format of the files: "wav", "flac" or "opus"
+			container		(str):		"segment" to write one file per sentence, "session" to append the sentences of a stream to one file
+			rollover		(float):	Duration of audio (in seconds) after which a new session file is started (0 to never start a new one)
+			max_pending		(int):		Maximum number of sentences waiting to be saved, the next ones are dropped (the capture never waits)
+		"""
+		if archive_format not in ARCHIVE_CODECS:
+			raise ValueError(f"Unknown archive format '{archive_format}', available formats: {', '.join(ARCHIVE_CODECS)}")
+		self.format: str = archive_format
+		self.extension: str = ARCHIVE_CODECS[archive_format][1]
+		self.container: str = container
+		self.rollover: float = rollover
+		self.dropped: int = 0									# Number of sentences dropped because the queue was full
+		self.encoders: dict[str, AudioEncoder] = {}				# Open session files, by stream (only used by the writer thread)
+		self.queue: queue.Queue = queue.Queue(maxsize = max_pending)
+		self.thread: threading.Thread = threading.Thread(target = self.worker, daemon = True)
+		self.thread.start()
+
+	def submit(self, pcm: bytes, name: str, rate: int = RATE, stream: str = "") -> str|None:
+		""" Queue audio data to be saved (returns immediately)\n
+		Args:
+			pcm		(bytes):	Audio data (16-bit mono PCM)
+			name	(str):		Name of the sentence (file name without extension)
+			rate	(int):		Sample rate (Hz)
+			stream	(str):		Name of the session file the sentence is appended to in "session" mode (e.g. "recorder")
+		Returns:
+			str|None: Path of the audio file of the sentence, None if it has no file of its own (session mode or dropped)
+		"""
+		try:
+			self.queue.put_nowait((bytes(pcm), name, rate, stream or name))
+		except queue.Full:
+			self.dropped += 1
+			warning(f"Audio archive queue full, the audio of '{name}' is not saved ({self.dropped} dropped)")
+			return None
+		return f"{AUDIO_FOLDER}/{name}.{self.extension}" if self.container == "segment" else None
+
+	def close_stream(self, stream: str) -> None:
+		""" Finish the session file of a stream once the sentences queued before are saved (e.g. when a session ends) """
+		self.queue.put((None, "", 0, stream))
+
+	def worker(self) -> None:
+		""" Save the queued audio data until None is received """
+		while (item := self.queue.get()) is not None:
+			pcm, name, rate, stream = item
+			try:
+				if pcm is None:
+					self.close_encoder(stream)
+				else:
+					with metrics.timer("archive_write_seconds", format = self.format):
+						if self.container == "segment":
+							self.write_segment(pcm, name, rate)
+						else:
+							self.append(pcm, rate, stream)
+				if DEBUG_MODE and pcm is not None:
+					debug(f"Audio of '{name}' archived ({self.format})")
+			except Exception as e:
+				error(f"Error while saving the audio of '{name or stream}': {e}", exit = False)
+			self.queue.task_done()
+
+		# Finish the session files
+		for stream in list(self.encoders):
+			self.close_encoder(stream)
+		self.queue.task_done()
+
+	def write_segment(self, pcm: bytes, name: str, rate: int) -> None:
+		""" Save a sentence to its own file """
+		if self.format == "wav":
+			save_audio(pcm, f"{name}.wav", rate)
+			return
+		encoder: AudioEncoder = AudioEncoder(f"{AUDIO_FOLDER}/{name}.{self.extension}", rate, self.format)
+		encoder.write(pcm)
+		encoder.close()
+
+	def append(self, pcm: bytes, rate: int, stream: str) -> None:
+		""" Append a sentence to the session file of its stream, starting a new file when the rollover duration is reached """
+		encoder: AudioEncoder|None = self.encoders.get(stream)
+		if encoder is not None and (encoder.rate != rate or (self.rollover > 0 and encoder.samples >= self.rollover * rate)):
+			self.close_encoder(stream)
+			encoder = None
+		if encoder is None:
+			os.makedirs(AUDIO_FOLDER, exist_ok = True)
+			path: str = f"{AUDIO_FOLDER}/{stream}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.{self.extension}"
+			encoder = self.encoders[stream] = AudioEncoder(path, rate, self.format)
+			info(f"Archiving the '{stream}' audio to '{os.path.basename(path)}'")
+		encoder.write(pcm)
+
+	def close_encoder(self, stream: str) -> None:
+		""" Finish the session file of a stream if it is open """
+		encoder: AudioEncoder|None = self.encoders.pop(stream, None)
+		if encoder is not None:
+			encoder.close()
+
+	def wait(self) -> None:
+		""" Wait until every queued audio data is saved """
+		self.queue.join()
+
+	def close(self) -> None:
+		""" Save the remaining audio data, finish the session files and stop the writer thread """
+		self.queue.put(None)
+		self.thread.join()
+
+
+# Shared archiver (created on first use)
+archiver: AudioArchiver|None = None
+archiver_lock: threading.Lock = threading.Lock()
+def get_archiver() -> AudioArchiver:
+	""" Get the shared audio archiver\n
+	Returns:
+		AudioArchiver: The shared archiver
+	"""
+	global archiver
+	with archiver_lock:
+		if archiver is None:
+			archiver = AudioArchiver()
+		return archiver
+
+def close_archiver() -> None:
+	""" Save the remaining audio data and stop the shared archiver """
+	global archiver
+	with archiver_lock:
+		if archiver is not None:
+			archiver.close()
+			archiver = None
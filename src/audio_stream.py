@@ -1,18 +1,89 @@
 
 ## Imports
 from config import *
+from src.print import *
+from src.resampler import Resampler
 import threading
 import pyaudiowpatch as pyaudio
 import numpy as np
 
+# RingBuffer class to store 16-bit mono samples in a fixed amount of memory
+class RingBuffer:
+	def __init__(self, capacity: int):
+		""" Preallocate the ring buffer\n
+		The buffer is mirrored (every sample is written twice) so that any window of unread samples is contiguous
+		and can be handed out as a view without copying.\n
+		Args:
+			capacity	(int):	Maximum number of unread samples kept (the oldest ones are dropped when full)
+		"""
+		self.capacity: int = capacity
+		self.buffer: np.ndarray = np.zeros(2 * capacity, dtype = np.int16)
+		self.write_index: int = 0			# Total number of samples written
+		self.read_index: int = 0			# Total number of samples read
+		self.dropped: int = 0				# Total number of samples dropped because the reader was too slow
+		self.dropped_read: int = 0			# Number of dropped samples already reported by read()
+		self.lock: threading.Lock = threading.Lock()
+
+	def write(self, samples: np.ndarray) -> None:
+		""" Copy the samples in the ring buffer\n
+		Args:
+			samples	(np.ndarray):	16-bit mono samples
+		"""
+		with self.lock:
+			# Only the last 'capacity' samples can be kept
+			if len(samples) > self.capacity:
+				self.write_index += len(samples) - self.capacity
+				samples = samples[-self.capacity:]
+
+			# Write the samples in both halves of the buffer
+			size: int = len(samples)
+			start: int = self.write_index % self.capacity
+			first: int = min(size, self.capacity - start)
+			self.buffer[start:start + first] = samples[:first]
+			self.buffer[start + self.capacity:start + self.capacity + first] = samples[:first]
+			if first < size:
+				self.buffer[:size - first] = samples[first:]
+				self.buffer[self.capacity:self.capacity + size - first] = samples[first:]
+			self.write_index += size
+
+			# Drop the oldest unread samples if the reader is too slow
+			if self.write_index - self.read_index > self.capacity:
+				self.dropped += self.write_index - self.read_index - self.capacity
+				self.read_index = self.write_index - self.capacity
+
+	def write_silence(self, count: int) -> None:
+		""" Write 'count' zero samples (only the last 'capacity' ones are really written, the others count as dropped) """
+		with self.lock:
+			self.write_index += max(0, count - self.capacity)
+		self.write(np.zeros(min(count, self.capacity), dtype = np.int16))
+
+	def read(self) -> tuple[memoryview, int]:
+		""" Get the unread samples as a bytes view (no copy)\n
+		The view stays valid until 'capacity' new samples are written, so it must be consumed (or copied) before that.\n
+		Returns:
+			memoryview: Unread samples (16-bit mono PCM)
+			int: Number of samples dropped just before them since the last call
+		"""
+		with self.lock:
+			start: int = self.read_index % self.capacity
+			size: int = self.write_index - self.read_index
+			self.read_index = self.write_index
+			dropped: int = self.dropped - self.dropped_read
+			self.dropped_read = self.dropped
+		return memoryview(self.buffer[start:start + size]).cast("B"), dropped
+
+
 # AudioStream class to handle audio input from a device
 class AudioStream:
-	def __init__(self, device_index: int, rate: int, chunk: int):
+	def __init__(self, device_index: int, rate: int, chunk: int, use_callback: bool = CALLBACK_CAPTURE, output_rate: int = ANALYSIS_RATE, keep_full_rate: bool = False):
 		""" Initialize the audio stream with the given parameters\n
 		Args:
 			device_index	(int):	Index of the audio device to use
-			rate			(int):	Sample rate (Hz)
+			rate			(int):	Sample rate of the capture (Hz)
 			chunk			(int):	Buffer size
+			use_callback	(bool):	Let PortAudio push the frames through a callback instead of reading them from a dedicated thread
+			output_rate		(int):	Sample rate of the frames returned by get_frames() (Hz)
+			keep_full_rate	(bool):	Keep the last captured audio at the capture rate (see get_full_rate)
 		"""
 		# Initialize the audio stream
 		self.p: pyaudio.PyAudio = pyaudio.PyAudio()
@@ -24,7 +95,7 @@ class AudioStream:
 			message: str = f"Device '{device_info['name']}' does not support input channels!"
 			raise ValueError(message)
 		else:
-			print(f"Device '{device_info['name']}' supports {self.channels} input channels")
+			info(f"Device '{device_info['name']}' supports {self.channels} input channels")
 
 		# Open the audio stream
 		self.stream: pyaudio.Stream = self.p.open(
@@ -33,21 +104,90 @@ class AudioStream:
 			rate = rate,
 			input = True,
 			frames_per_buffer = chunk,
-			input_device_index = device_index
+			input_device_index = device_index,
+			stream_callback = self.callback if use_callback else None,
+			start = not use_callback
 		)
 
-		# Initialize the frames and threading lock
-		self.frames: bytes = b""
-		self.lock: threading.Lock = threading.Lock()
+		# Initialize the ring buffer holding the frames, and the scratch buffer used for the downmix
+		self.frames: RingBuffer = RingBuffer(int(BUFFER_DURATION * rate))
+		self.mix_buffer: np.ndarray = np.empty(chunk, dtype = np.int32)
+
+		# The positions in the stream follow the capture clock: the gaps of the device (e.g. a loopback device while nothing is playing)
+		# and the samples dropped by the ring buffer are replaced by silence, so that the streams of different devices stay aligned.
+		# A gap is measured between two consecutive buffers only (capture time of their first sample), so the drift of the device clock never adds up
+		self.last_time: float|None = None		# Capture time of the first sample of the previous buffer
+		self.last_size: int = 0					# Number of samples of the previous buffer
+		self.gap_tolerance: int = max(2 * chunk, int(0.1 * rate))	# Gap (in samples) between two buffers tolerated before filling with silence
+
+		# Resample the frames when they are read (outside of the capture callback)
+		self.rate: int = rate
+		self.output_rate: int = output_rate
+		self.resampler: Resampler|None = Resampler(rate, output_rate) if output_rate != rate else None
+
+		# Audio at the capture rate, kept long enough to cover the longest sentence (only if needed, e.g. for archiving)
+		self.keep_full_rate: bool = keep_full_rate
+		self.full_rate: bytearray = bytearray()
+		self.full_rate_start: int = 0			# Position (in samples) of the first sample of self.full_rate in the stream
+		self.full_rate_size: int = 2 * int((2 * MAXIMUM_DURATION + BUFFER_DURATION) * rate)
 
 		# Set the running flag to False
+		self.use_callback: bool = use_callback
 		self.is_running: bool = False
+		self.thread: threading.Thread|None = None
 
 	def start(self) -> None:
-		""" Start the audio thread to listen to the audio stream """
+		""" Start the audio callback, or the audio thread to listen to the audio stream """
 		self.is_running = True
-		self.thread: threading.Thread = threading.Thread(target = self.listen)
-		self.thread.start()
+		self.last_time = self.stream.get_time() or None		# Start of the stream (the device may deliver nothing at first)
+		self.last_size = 0
+		if self.use_callback:
+			self.stream.start_stream()
+		else:
+			self.thread = threading.Thread(target = self.listen)
+			self.thread.start()
+
+	def downmix(self, data: bytes) -> np.ndarray:
+		""" Convert interleaved audio data to mono using integer arithmetic only (no float temporary)\n
+		Args:
+			data	(bytes):	Interleaved 16-bit audio data
+		Returns:
+			np.ndarray: Mono samples (a view on the scratch buffer when downmixing, valid until the next call)
+		"""
+		audio_data: np.ndarray = np.frombuffer(data, np.int16)
+		if self.channels == 1:
+			return audio_data
+
+		# Sum the channels in the int32 scratch buffer and divide in place
+		audio_data = audio_data.reshape(-1, self.channels)
+		if len(self.mix_buffer) < len(audio_data):
+			self.mix_buffer = np.empty(len(audio_data), dtype = np.int32)
+		mono_data: np.ndarray = self.mix_buffer[:len(audio_data)]
+		np.sum(audio_data, axis = 1, dtype = np.int32, out = mono_data)
+		mono_data //= self.channels
+		return mono_data
+
+	def store(self, samples: np.ndarray, capture_time: float, overflow: bool = False) -> None:
+		""" Store captured samples in the ring buffer, after silence for the time the device delivered nothing\n
+
+		Args:
+			samples			(np.ndarray):	Mono samples
+			capture_time	(float):		Capture time (in seconds) of the first sample, on the clock of the stream (see pyaudio.Stream.get_time)
+			overflow		(bool):			The device reported lost input (the gap is then filled even if it is short)
+		"""
+		if self.last_time is not None:
+			missing: int = round((capture_time - self.last_time) * self.rate) - self.last_size
+			if missing > self.gap_tolerance or (overflow and missing > 0):
+				self.frames.write_silence(missing)
+		self.last_time, self.last_size = capture_time, len(samples)
+		self.frames.write(samples)
+
+	def callback(self, in_data: bytes, frame_count: int, time_info: dict, status: int) -> tuple[None, int]:
+		""" PortAudio callback storing the received frames directly in the ring buffer """
+		# Time of the capture given by PortAudio (not delayed by the scheduling of the callback), if the host API provides it
+		capture_time: float = time_info.get("input_buffer_adc_time", 0.0) or self.stream.get_time() - frame_count / self.rate
+		self.store(self.downmix(in_data), capture_time, bool(status & pyaudio.paInputOverflow))
+		return None, pyaudio.paContinue
 
 	def listen(self) -> None:
 		""" Listen to the audio stream and store the frames """
@@ -56,35 +196,54 @@ class AudioStream:
 			# Read the audio data from the stream
 			data: bytes = self.stream.read(CHUNK_SIZE, exception_on_overflow = False)
 
-			if self.channels > 1:
-				# Convert byte data to numpy array
-				audio_data: np.ndarray = np.frombuffer(data, np.int16)
-
-				# Force the audio data to be mono
-				mono_data: np.ndarray = audio_data.reshape(-1, self.channels).mean(axis = 1).astype(np.int16)
+			# Capture time of the first sample: the frames read and the ones still waiting in PortAudio were captured before now
+			capture_time: float = self.stream.get_time() - (len(data) // (2 * self.channels) + self.stream.get_read_available()) / self.rate
 
-				# Convert the mono data back to bytes
-				data: bytes = mono_data.tobytes()
-
-			# Store the audio data in the frames list
-			with self.lock:
-				self.frames += data
+			# Force the audio data to be mono and store it in the ring buffer
+			self.store(self.downmix(data), capture_time)
 
 	def stop(self) -> None:
 		""" Stop the audio thread and close the audio stream """
 		# Stop the thread and join it
 		self.is_running = False
-		self.thread.join(timeout = 1.0)
+		if self.thread is not None:
+			self.thread.join(timeout = 1.0)
 
 		# Stop and close the audio stream
 		self.stream.stop_stream()
 		self.stream.close()
 		self.p.terminate()
 
-	def get_frames(self) -> bytes:
-		""" Get the frames stored in the audio stream and clear the frames list """
-		with self.lock:
-			frames: bytes = self.frames
-			self.frames = b""
-		return frames
+	def get_frames(self) -> bytes|memoryview:
+		""" Get the frames received since the last call, at the output rate\n
+		Returns:
+			bytes|memoryview: Audio data (16-bit mono PCM), a view on the ring buffer if no resampling is needed (see RingBuffer.read)
+		"""
+		frames, dropped = self.frames.read()
+
+		# Replace the samples dropped by the ring buffer by silence (the times of the stream stay on the capture clock)
+		if dropped:
+			frames = memoryview(bytes(2 * dropped) + frames)
+		if self.keep_full_rate:
+			self.full_rate += frames
+			if len(self.full_rate) > self.full_rate_size:
+				excess: int = len(self.full_rate) - self.full_rate_size
+				del self.full_rate[:excess]
+				self.full_rate_start += excess // 2
+		if self.resampler is None:
+			return frames
+		return self.resampler.process(frames)
+
+	def get_full_rate(self, start: float, end: float) -> bytes|None:
+		""" Get the audio at the capture rate between two times (only if keep_full_rate is enabled)\n
+		Args:
+			start	(float):	Start time (in seconds since the start of the stream)
+			end		(float):	End time (in seconds since the start of the stream)
+		Returns:
+			bytes|None: Audio data (16-bit mono PCM at self.rate), None if it is not available anymore
+		"""
+		first: int = int(start * self.rate) - self.full_rate_start
+		if not self.keep_full_rate or first < 0:
+			return None
+		return bytes(self.full_rate[2 * first:2 * (int(end * self.rate) - self.full_rate_start)])
 
@@ -5,6 +5,9 @@ from src.print import *
 import pyaudiowpatch as pyaudio
 import wave
 
+# Sample width of the audio (16-bit)
+SAMPLE_WIDTH: int = pyaudio.get_sample_size(pyaudio.paInt16)
+
 # Audio saving function
 def save_audio(frames: bytes, filename: str, rate: int = RATE) -> None:
 	""" Save the audio data to a WAV file\n
@@ -23,7 +26,7 @@ def save_audio(frames: bytes, filename: str, rate: int = RATE) -> None:
 	# Open the WAV file and write the frames
 	with wave.open(filepath, 'wb') as wf:
 		wf.setnchannels(1)
-		wf.setsampwidth(pyaudio.PyAudio().get_sample_size(pyaudio.paInt16))
+		wf.setsampwidth(SAMPLE_WIDTH)
 		wf.setframerate(rate)
 		wf.writeframes(frames)
 
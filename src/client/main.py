@@ -4,13 +4,44 @@ from config import *
 from src.print import *
 from src.folder_utils import move_transcripts_and_audio_files
 from src.audio_stream import AudioStream
-from src.audio_utils import save_audio, find_device
-from src.silence import *
-from src.transcript_utils import manage_new_audios, make_the_report
+from src.audio_utils import find_device
+from src.audio_archive import get_archiver, close_archiver
+from src.segmenter import Segmenter
+from src.echo import EchoSuppressor
+from src.transcript_utils import get_transcription_queue, update_the_big_transcript, make_the_report
+from src.transcription_queue import TranscriptionQueue
+from src.metrics import metrics
+from src.manifest import SegmentManifest, get_manifest, close_manifest, find_last_session
 from datetime import datetime
 import pyaudiowpatch as pyaudio
 
 
+# Function to send a sentence to the transcription workers
+def save_segment(manifest: SegmentManifest, transcription_queue: TranscriptionQueue, name: str, segment: tuple[bytes, float, float], stream: AudioStream, offset: float = 0.0) -> None:
+	""" Register a sentence in the manifest and queue its audio for transcription (without waiting for the transcript)\n
+	The audio is handed over in memory, it is only saved to a file (in the background) if KEEP_AUDIO_FILES is enabled.\n
+	Args:
+		manifest			(SegmentManifest):		Manifest of the session
+		transcription_queue	(TranscriptionQueue):	Transcription queue
+		name				(str):					Name of the stream
+		segment				(tuple):				Audio data of the sentence (at ANALYSIS_RATE), its start and end time (in seconds)
+		stream				(AudioStream):			Audio stream of the sentence (to archive it at the capture rate if ARCHIVE_FULL_RATE is enabled)
+		offset				(float):				Time of the session (in seconds) at which the audio streams started (end of the resumed session)
+	"""
+	pcm, start, end = segment
+	audio_file: str|None = None
+	if KEEP_AUDIO_FILES:
+		full_rate: bytes|None = stream.get_full_rate(start, end)
+		archive, rate = (full_rate, stream.rate) if full_rate else (pcm, ANALYSIS_RATE)
+		audio_file = get_archiver().submit(archive, f"{name}_{manifest.count(name) + 1}", rate, name)
+	metrics.increment("segments_total", source = name)
+	metrics.increment("segment_audio_seconds_total", end - start, source = name)
+	debug(f"New sentence on the '{name}' stream ({end - start:.2f}s)")
+	transcription_queue.submit(manifest.add(name, offset + start, offset + end, audio_file, pcm = pcm, rate = ANALYSIS_RATE))
+	if DEBUG_MODE:
+		debug(f"Transcription queue: {transcription_queue.stats()}")
+
+
 # Main function
 def client_main():
 	START_TIME: float = time.perf_counter()			# Start time of the application
@@ -25,8 +56,17 @@ def client_main():
 	for folder in [TRANSCRIPT_FOLDER, AUDIO_FOLDER, OUTPUT_FOLDER]:
 		os.makedirs(folder, exist_ok = True)
 
-	# Move every transcript and audio files in subfolders
-	move_transcripts_and_audio_files(START_TIME, START_TIME_STR)
+	# Resume the last session if needed, else move every transcript and audio files in subfolders
+	last_session: str|None = find_last_session() if RESUME_SESSION else None
+	if last_session is not None:
+		START_TIME_STR = last_session
+		info(f"Resuming the session started at {START_TIME_STR}")
+	else:
+		move_transcripts_and_audio_files(START_TIME, START_TIME_STR)
+	manifest: SegmentManifest = get_manifest(START_TIME_STR)
+
+	# The times of the new sentences follow the ones recorded before (the audio streams start again at 0)
+	time_offset: float = max((segment.end for segment in manifest.segments), default = 0.0)
 
 	# Initialize the audio port
 	p: pyaudio.PyAudio = pyaudio.PyAudio()
@@ -50,35 +90,34 @@ def client_main():
 	if recorder_index is None and playback_index is None:
 		error("No recording device found, exiting...")
 	
-	# Initialize the audio streams
+	# Initialize the audio streams (resampled to ANALYSIS_RATE, the capture rate is only kept for the archive if needed)
+	# The playback stream is read first so that its audio is known when the recorder sentences are checked for echo
+	keep_full_rate: bool = KEEP_AUDIO_FILES and ARCHIVE_FULL_RATE
 	audio_streams: dict[str, dict] = {}
-	if recorder_index is not None:
-		audio_streams["recorder"] = {"stream": AudioStream(recorder_index, RATE, CHUNK_SIZE)}
 	if playback_index is not None:
-		audio_streams["playback"] = {"stream": AudioStream(playback_index, RATE, CHUNK_SIZE), "threshold": 100}	# Threshold for playback is lower as it is usually quieter
+		audio_streams["playback"] = {"stream": AudioStream(playback_index, RATE, CHUNK_SIZE, keep_full_rate = keep_full_rate), "threshold": 100}	# Threshold for playback is lower as it is usually quieter
+	if recorder_index is not None:
+		audio_streams["recorder"] = {"stream": AudioStream(recorder_index, RATE, CHUNK_SIZE, keep_full_rate = keep_full_rate)}
+	echo_suppressor: EchoSuppressor|None = EchoSuppressor(ANALYSIS_RATE) if ECHO_SUPPRESSION and len(audio_streams) == 2 else None
 	
-	# Start the audio streams
+	# Start the audio streams and the transcription workers
 	for stream in audio_streams.values():
 		stream["stream"].start()
+	transcription_queue: TranscriptionQueue = get_transcription_queue()
+	for segment in manifest.pending():
+		transcription_queue.submit(segment)
 
-	# Variables for silence detection
-	chunks_per_second: float = RATE									# Number of chunks per second
-	minimum_chunks: float = MINIMUM_DURATION * chunks_per_second	# Number of chunks needed to reach the minimum duration
-	maximum_chunks: float = MAXIMUM_DURATION * chunks_per_second	# Number of chunks needed to reach the maximum duration
-	not_initialized_silence: int = -10000000						# Value to avoid saving the same silence multiple times
+	# Initialize the segmenters (cutting the sentences at the start of the silences)
 	for stream in audio_streams.values():
-		stream["silence_counter"] = not_initialized_silence
-		stream["saved_files"] = 0
-		stream["joined_chunks"] = b""
-		if not stream.get("threshold"):
-			stream["threshold"] = SILENCE_THRESHOLD
-	info(f"Chunks per second: {chunks_per_second} - Silence time: {SLEEP_INTERVAL} - Minimum chunks: {minimum_chunks} - Maximum chunks: {maximum_chunks}")
+		stream["segmenter"] = Segmenter(ANALYSIS_RATE, stream.get("threshold", SILENCE_THRESHOLD))
+	info(f"Silence duration: {SILENCE_DURATION}s - Minimum duration: {MINIMUM_DURATION}s - Maximum duration: {MAXIMUM_DURATION}s (cut at the quietest point of the last {CUT_LOOKBACK}s) - Pre-roll: {PRE_ROLL}s - Post-roll: {POST_ROLL}s")
 	
 	# Start the main loop
 	debug("Starting the main loop, press Ctrl+C to stop the application...")
 	try:
-		saved_files_on_this_iteration: int = 0
+		merged_transcripts: int = 0
 		time_since_last_report: float = 0
+		time_since_last_metrics: float = time.perf_counter()
 		while True:
 
 			# Sleep for a short time
@@ -87,48 +126,33 @@ def client_main():
 			# Check the audio streams
 			for name, items in audio_streams.items():
 				stream: AudioStream = items["stream"]
-
-				# Get frames and append them to the already stored frames
-				frames: bytes = stream.get_frames()
-					
-				# Check if the audio is silent
-				if is_silent(frames, threshold = items["threshold"]):
-					if items["silence_counter"] != not_initialized_silence:
-						items["silence_counter"] += SLEEP_INTERVAL
-						if DEBUG_MODE:
-							debug(f"Silence detected on the '{name}' stream (counter: {items['silence_counter']})")
-				else:
-					items["joined_chunks"] += frames
-					items["silence_counter"] = 0
-					if DEBUG_MODE:
-						debug(f"Audio detected on the '{name}' stream (adding {len(frames)} chunks to join, now {len(items['joined_chunks'])} chunks)")
-				
-				# Check if the silence duration is reached
-				if items["silence_counter"] >= SILENCE_DURATION:
-					items["joined_chunks"] += frames
-
-					# If the minimum duration is reached, save the audio to a file
-					if len(items["joined_chunks"]) >= minimum_chunks:
-
-						# Save the audio to a file
-						if not DEBUG_MODE:
-							debug(f"Silence detected on the '{name}' stream, saving the audio...")
-						else:
-							debug(f"Silence detected on the '{name}' stream, saving the audio ({len(items['joined_chunks'])} chunks > {minimum_chunks} chunks)...")
-						items["saved_files"] += 1
-						filename: str = f"{name}_{items['saved_files']}.wav"
-						save_audio(items["joined_chunks"], filename)
-						debug(f"Audio saved to '{filename}' for the '{name}' stream")
-						saved_files_on_this_iteration += 1
-
-					# Reset the silence counter and the chunks to join
-					items["silence_counter"] = not_initialized_silence
-					items["joined_chunks"] = b""
+				segmenter: Segmenter = items["segmenter"]
+
+				# Get frames and cut the finished sentences
+				with metrics.timer("capture_read_seconds", source = name):
+					frames: bytes|memoryview = stream.get_frames()
+				with metrics.timer("segment_cut_seconds", source = name):
+					segments: list[tuple[bytes, float, float]] = segmenter.feed(frames)
+				if echo_suppressor is not None and name == "playback":
+					echo_suppressor.feed(frames)
+				for segment in segments:
+
+					# Remove the playback audio heard by the microphone (the whole sentence if it is mostly echo)
+					if echo_suppressor is not None and name == "recorder":
+						pcm: bytes|None = echo_suppressor.process(segment[0], segment[1])
+						if pcm is None:
+							debug(f"Sentence of the 'recorder' stream dropped, it is the playback audio ({segment[2] - segment[1]:.2f}s)")
+							continue
+						segment = (pcm, segment[1], segment[2])
+					save_segment(manifest, transcription_queue, name, segment, stream, time_offset)
+				if DEBUG_MODE and segmenter.in_speech:
+					debug(f"Audio detected on the '{name}' stream ({len(segmenter.segment) / (2 * ANALYSIS_RATE):.2f}s in the current sentence)")
 			
-			# Transcription of the saved files
-			if saved_files_on_this_iteration > 0:
-				saved_files_on_this_iteration = 0	# Reset the counter
-				manage_new_audios(START_TIME_STR)		# Manage the new audio files
+			# Update the big transcript when new transcripts are ready
+			delivered: int = transcription_queue.stats()["delivered"]
+			if delivered > merged_transcripts:
+				merged_transcripts = delivered
+				update_the_big_transcript(START_TIME_STR)
 
 				# Update the report if needed
 				now: float = time.perf_counter()
@@ -136,6 +160,14 @@ def client_main():
 					time_since_last_report = now
 					make_the_report(START_TIME_STR, not_final=True)
 
+			# Write the metrics if needed
+			now = time.perf_counter()
+			if METRICS_INTERVAL > 0 and (now - time_since_last_metrics) >= METRICS_INTERVAL:
+				time_since_last_metrics = now
+				metrics.dump(f"{OUTPUT_FOLDER}/metrics_{START_TIME_STR}.prom")
+				if DEBUG_MODE:
+					debug(f"Metrics: {metrics.summary()}")
+
 	except KeyboardInterrupt:
 		info("Keyboard interrupt detected, stopping the application...")
 
@@ -144,8 +176,22 @@ def client_main():
 		stream["stream"].stop()
 	p.terminate()
 
+	# Save the sentences in progress
+	for name, items in audio_streams.items():
+		for segment in items["segmenter"].flush():
+			save_segment(manifest, transcription_queue, name, segment, items["stream"], time_offset)
+
+	# Wait for the remaining transcripts
+	info(f"Waiting for the remaining transcripts ({transcription_queue.stats()['pending']} pending)...")
+	transcription_queue.shutdown()
+	close_archiver()
+
 	# Make the final report
 	make_the_report(START_TIME_STR, not_final=False)
+	close_manifest(START_TIME_STR)
+	if METRICS_INTERVAL > 0:
+		metrics.dump(f"{OUTPUT_FOLDER}/metrics_{START_TIME_STR}.prom")
+		info(f"Metrics: {metrics.summary()}")
 
 	# Move every transcript and audio files in subfolders
 	move_transcripts_and_audio_files(START_TIME, START_TIME_STR)
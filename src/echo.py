@@ -0,0 +1,113 @@
+
+## Imports
+from config import *
+from src.vad import as_samples
+from src.metrics import metrics
+from numpy.lib.stride_tricks import sliding_window_view
+import numpy as np
+
+# EchoSuppressor class to detect the playback audio leaking into the microphone
+class EchoSuppressor:
+	def __init__(self, rate: int = ANALYSIS_RATE, max_delay: float = ECHO_MAX_DELAY, window: float = ECHO_WINDOW, threshold: float = ECHO_THRESHOLD, drop_ratio: float = ECHO_DROP_RATIO, history: float = MAXIMUM_DURATION + 5.0):
+		""" Initialize the suppressor\n
+		The recorder sentences are split in overlapping windows, each window is cross-correlated (with FFTs, all windows at once)
+		with the playback audio heard at the same time, allowing for the delay of the speakers and the microphone.
+		Both streams must be on the capture clock (AudioStream fills the gaps of the devices and the dropped samples with silence),
+		so that a position in the recorder stream is the same moment in the playback stream.\n
+		Args:
+			rate		(int):		Sample rate (Hz) of both streams
+			max_delay	(float):	Maximum delay (in seconds) between the playback audio and its echo in the microphone
+			window		(float):	Duration (in seconds) of the windows compared
+			threshold	(float):	Normalized correlation (between 0 and 1) above which a window is an echo
+			drop_ratio	(float):	Ratio of echo windows above which the whole sentence is dropped (the echo windows are muted below it)
+			history		(float):	Duration (in seconds) of playback audio kept (must cover the longest sentence)
+		"""
+		self.rate: int = rate
+		self.window: int = max(1, int(window * rate))
+		self.hop: int = max(1, self.window // 2)
+		self.lead: int = int(0.1 * rate)					# The playback stream may also be captured slightly after the microphone
+		self.max_delay: int = int(max_delay * rate)
+		self.threshold: float = threshold
+		self.drop_ratio: float = drop_ratio
+		self.history_size: int = int(history * rate)
+		self.history: bytearray = bytearray()				# Last playback audio received
+		self.history_end: int = 0							# Position (in samples) of the end of the history in the playback stream
+
+	def feed(self, data: bytes|memoryview) -> None:
+		""" Add new playback audio to the history (every frame of the playback stream must be given, in order) """
+		self.history += data
+		self.history_end += len(data) // 2
+		if len(self.history) > 2 * self.history_size:
+			del self.history[:len(self.history) - 2 * self.history_size]
+
+	def playback(self, start: int, end: int) -> np.ndarray:
+		""" Get the playback samples between two positions (in samples), zeros where the history does not cover them """
+		history_start: int = self.history_end - len(self.history) // 2
+		samples: np.ndarray = np.zeros(end - start, np.float32)
+		first, last = max(start, history_start), min(end, self.history_end)
+		if first < last:
+			samples[first - start:last - start] = as_samples(bytes(self.history[2 * (first - history_start):2 * (last - history_start)]))
+		return samples
+
+	def correlations(self, pcm: bytes, start: float) -> tuple[np.ndarray, np.ndarray]:
+		""" Compute the best normalized correlation of each window of a recorder sentence with the playback audio\n
+		Args:
+			pcm		(bytes):	Audio data of the sentence (16-bit mono PCM)
+			start	(float):	Start time of the sentence (in seconds since the start of the stream)
+		Returns:
+			np.ndarray: Best correlation of each window (between 0 and 1)
+			np.ndarray: True for the windows loud enough to be compared
+		"""
+		recorder: np.ndarray = as_samples(pcm).astype(np.float32)
+		window: int = min(self.window, len(recorder))
+		windows: np.ndarray = sliding_window_view(recorder, window)[::self.hop]
+
+		# Playback audio around each window (from 'max_delay' before to 'lead' after)
+		position: int = round(start * self.rate)
+		span: int = window + self.max_delay + self.lead
+		reference: np.ndarray = self.playback(position - self.max_delay, position + (len(windows) - 1) * self.hop + window + self.lead)
+		references: np.ndarray = sliding_window_view(reference, span)[::self.hop][:len(windows)]
+
+		# Cross-correlation of every window at every delay, in the frequency domain
+		size: int = 1 << int(span + window - 1).bit_length()
+		spectrum: np.ndarray = np.fft.rfft(references, size, axis = 1) * np.conj(np.fft.rfft(windows, size, axis = 1))
+		correlation: np.ndarray = np.fft.irfft(spectrum, size, axis = 1)[:, :span - window + 1]
+
+		# Normalize by the energy of the window and of the playback audio at each delay
+		window_energy: np.ndarray = np.einsum("ij,ij->i", windows, windows, dtype = np.float64)
+		cumulative: np.ndarray = np.concatenate((np.zeros((len(references), 1), np.float64), np.cumsum(references.astype(np.float64) ** 2, axis = 1)), axis = 1)
+		reference_energy: np.ndarray = cumulative[:, window:] - cumulative[:, :-window]
+		norm: np.ndarray = np.sqrt(window_energy[:, None] * reference_energy) + 1e-9
+		best: np.ndarray = np.max(correlation / norm, axis = 1)
+		active: np.ndarray = np.sqrt(window_energy / window) >= SILENCE_THRESHOLD / 2
+		return best, active
+
+	def process(self, pcm: bytes, start: float) -> bytes|None:
+		""" Remove the echo of the playback audio from a recorder sentence\n
+		Args:
+			pcm		(bytes):	Audio data of the sentence (16-bit mono PCM)
+			start	(float):	Start time of the sentence (in seconds since the start of the stream)
+		Returns:
+			bytes|None: The sentence (with its echo parts muted), None if it is mostly echo
+		"""
+		if len(pcm) < 4 or len(self.history) == 0:
+			return pcm
+		with metrics.timer("echo_check_seconds"):
+			best, active = self.correlations(pcm, start)
+		echo: np.ndarray = (best >= self.threshold) & active
+		echo_count: int = int(np.count_nonzero(echo))
+		if echo_count == 0:
+			return pcm
+
+		# Mostly echo: drop the sentence
+		if echo_count >= self.drop_ratio * max(1, int(np.count_nonzero(active))):
+			metrics.increment("echo_segments_total", action = "dropped")
+			return None
+
+		# Partly echo: mute the part of each echo window that no other window covers before it
+		samples: np.ndarray = as_samples(pcm).copy()
+		for index in np.flatnonzero(echo):
+			end: int = len(samples) if index == len(echo) - 1 else (index + 1) * self.hop
+			samples[index * self.hop:end] = 0
+		metrics.increment("echo_segments_total", action = "attenuated")
+		return samples.tobytes()
@@ -1,6 +1,9 @@
 
 # Imports
 from config import *
+from collections.abc import Iterator
+import zipfile
+import re
 
 """
 for folder in [TRANSCRIPT_FOLDER, AUDIO_FOLDER]:
@@ -37,4 +40,116 @@ def move_transcripts_and_audio_files(start_time: float, start_time_str: str) ->
 			for file in files_to_move:
 				os.replace(file, f"{folder}/{start_time_str}/unknown/{os.path.basename(file)}")
 
+# Function to move the files of one session to its subfolders
+def move_session_files(session: str) -> None:
+	""" Move the transcripts and audio files whose name contains the session start time to subfolders named after it.\n
+	Unlike move_transcripts_and_audio_files(), the files of the other sessions running at the same time are left untouched.\n
+	Args:
+		session	(str):	Start time of the session as a string
+	"""
+	for folder in [TRANSCRIPT_FOLDER, AUDIO_FOLDER]:
+		files: list[str] = [f for f in os.listdir(folder) if session in f and os.path.isfile(f"{folder}/{f}")]
+		if files:
+			os.makedirs(f"{folder}/{session}", exist_ok = True)
+			for file in files:
+				os.replace(f"{folder}/{file}", f"{folder}/{session}/{file}")
+
+
+# Extensions of the files that are already compressed (stored as is in the zip files)
+STORED_EXTENSIONS: tuple[str, ...] = (".wav", ".flac", ".opus", ".ogg", ".mp3", ".webm", ".zip")
+
+# Unseekable file-like object collecting what zipfile writes
+class ZipStreamBuffer:
+	def __init__(self):
+		self.chunks: list[bytes] = []
+		self.size: int = 0			# Size of the data waiting to be sent
+		self.position: int = 0		# Total size written
+
+	def write(self, data: bytes) -> int:
+		self.chunks.append(bytes(data))
+		self.size += len(data)
+		self.position += len(data)
+		return len(data)
+
+	def tell(self) -> int:
+		return self.position
+
+	def flush(self) -> None:
+		pass
+
+	def pop(self) -> bytes:
+		""" Get the data written since the last call """
+		data: bytes = b"".join(self.chunks)
+		self.chunks = []
+		self.size = 0
+		return data
+
+
+# Start time of a session in a file name (e.g. "2024-01-31_14-00-00")
+SESSION_PATTERN: re.Pattern = re.compile(r"\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}")
+
+# Function to check if a file belongs to a session
+def belongs_to_session(relative_path: str, session: str) -> bool:
+	""" Check if a file belongs to a session, from its path relative to the listed folder\n
+	The session must be a whole folder name or a whole token of the file name (delimited by "_", "." or the ends of the name),
+	files at the root of the folder without any session in their name belong to every session (e.g. "recorder_3.flac").\n
+	Args:
+		relative_path	(str):	Path of the file relative to the listed folder (with "/" separators)
+		session			(str):	Start time of the session (possibly followed by the connection id)
+	Returns:
+		bool: True if the file belongs to the session
+	"""
+	*folders, name = relative_path.split("/")
+	if session in folders:
+		return True
+	if re.search(rf"(^|[_.]){re.escape(session)}([_.]|$)", name):
+		return True
+	return not folders and not SESSION_PATTERN.search(name)
+
+# Function to list the files to send in a zip file
+def list_files(folder: str, session: str|None = None, prefix: str = "") -> list[tuple[str, str]]:
+	""" List the files of a folder (recursively) with their name in the zip file\n
+	Args:
+		folder	(str):			Folder to list
+		session	(str|None):		If given, only keep the files of this session (see belongs_to_session)
+		prefix	(str):			Prefix of the names in the zip file
+	Returns:
+		list[tuple[str, str]]: Paths of the files and their names in the zip file
+	"""
+	files: list[tuple[str, str]] = []
+	for root, _, filenames in os.walk(folder):
+		for file in filenames:
+			path: str = os.path.join(root, file)
+			relative_path: str = os.path.relpath(path, folder).replace("\\", "/")
+			if file.endswith(".zip") or (session and not belongs_to_session(relative_path, session)):
+				continue
+			files.append((path, prefix + relative_path))
+	return files
+
+
+# Function to build a zip file chunk by chunk
+def stream_zip(files: list[tuple[str, str]], chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+	""" Build a zip file on the fly without writing it to the disk, memory usage stays around chunk_size\n
+	Audio files are stored as is, other files are compressed.\n
+	Args:
+		files		(list[tuple[str, str]]):	Paths of the files and their names in the zip file
+		chunk_size	(int):						Size of the chunks read from the files and yielded
+	Returns:
+		Iterator[bytes]: Chunks of the zip file
+	"""
+	buffer: ZipStreamBuffer = ZipStreamBuffer()
+	with zipfile.ZipFile(buffer, "w") as zipf:
+		for path, arcname in files:
+			zinfo: zipfile.ZipInfo = zipfile.ZipInfo.from_file(path, arcname)
+			zinfo.compress_type = zipfile.ZIP_STORED if path.lower().endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+			with open(path, "rb") as source, zipf.open(zinfo, "w", force_zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT) as destination:
+				while data := source.read(chunk_size):
+					destination.write(data)
+					if buffer.size >= chunk_size:
+						yield buffer.pop()
+			if buffer.size:
+				yield buffer.pop()
+
+	# Send the central directory written when closing the zip file
+	yield buffer.pop()
 
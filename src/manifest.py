@@ -0,0 +1,221 @@
+
+## Imports
+from config import *
+from src.print import *
+import threading
+import json
+
+# Segment states, in the order they are reached
+PENDING: str = "pending"			# Audio saved, waiting for its transcript
+TRANSCRIBED: str = "transcribed"	# Transcript available, not yet in the big transcript
+MERGED: str = "merged"				# Transcript appended to the big transcript
+
+# Segment class to describe one saved sentence
+class Segment:
+	def __init__(self, sequence: int, source: str, name: str, start: float, end: float, audio_file: str|None = None, rate: int = ANALYSIS_RATE, state: str = PENDING, transcript: str = ""):
+		""" Initialize the segment\n
+		Args:
+			sequence	(int):			Sequence number of the segment in the session
+			source		(str):			Source of the segment (e.g. "recorder", "playback", "server")
+			name		(str):			Name of the segment (e.g. "recorder_3"), used for the audio and transcript files
+			start		(float):		Start time of the segment (in seconds since the start of the stream)
+			end			(float):		End time of the segment (in seconds since the start of the stream)
+			audio_file	(str|None):		Path to the audio file if saved
+			rate		(int):			Sample rate of the audio (Hz)
+			state		(str):			State of the segment (PENDING, TRANSCRIBED or MERGED)
+			transcript	(str):			Transcript of the segment once available
+		"""
+		self.sequence: int = sequence
+		self.source: str = source
+		self.name: str = name
+		self.start: float = start
+		self.end: float = end
+		self.audio_file: str|None = audio_file
+		self.rate: int = rate
+		self.pcm: bytes|None = None			# Audio kept in memory until the segment is transcribed (not saved in the manifest)
+		self.state: str = state
+		self.transcript: str = transcript
+		self.manifest: SegmentManifest|None = None
+
+
+# SegmentManifest class to keep track of the segments of a session in an append-only JSON lines file
+class SegmentManifest:
+	def __init__(self, path: str, start_time: str = ""):
+		""" Open the manifest, replaying the existing records if the file already exists\n
+		Args:
+			path		(str):	Path to the manifest file
+			start_time	(str):	Start time of the session
+		"""
+		self.path: str = path
+		self.start_time: str = start_time
+		self.segments: list[Segment] = []			# Segments ordered by sequence number
+		self.pending_segments: dict[int, Segment] = {}
+		self.counts: dict[str, int] = {}			# Number of segments per source
+		self.merge_cursor: int = 0					# Sequence number of the next segment to merge
+		self.lock: threading.Lock = threading.Lock()
+		self.closed: bool = False					# True once the file is closed (late records are only kept in memory)
+
+		# Replay the existing records (a truncated last line from a crash is ignored)
+		truncated: bool = False
+		if os.path.exists(path):
+			with open(path, "r", encoding="utf-8") as f:
+				for line in f:
+					truncated = not line.endswith("\n")
+					try:
+						self.apply(json.loads(line))
+					except (json.JSONDecodeError, KeyError, IndexError):
+						warning(f"Ignoring a corrupted record in the manifest '{os.path.basename(path)}'")
+			while self.merge_cursor < len(self.segments) and self.segments[self.merge_cursor].state == MERGED:
+				self.merge_cursor += 1
+			info(f"Manifest '{os.path.basename(path)}' loaded: {len(self.segments)} segments, {len(self.pending_segments)} pending")
+		self.file = open(path, "a", encoding="utf-8")
+		if truncated:
+			self.file.write("\n")
+
+	def apply(self, record: dict) -> None:
+		""" Apply one record of the manifest to the in-memory state """
+		if record["event"] == "add":
+			segment: Segment = Segment(**record["segment"])
+			segment.manifest = self
+			self.segments.append(segment)
+			self.counts[segment.source] = self.counts.get(segment.source, 0) + 1
+			if segment.state == PENDING:
+				self.pending_segments[segment.sequence] = segment
+		else:
+			segment: Segment = self.segments[record["sequence"]]
+			segment.state = record["state"]
+			if "transcript" in record:
+				segment.transcript = record["transcript"]
+			if record["state"] != PENDING:
+				self.pending_segments.pop(segment.sequence, None)
+
+	def write(self, *records: dict) -> None:
+		""" Append records to the manifest file and make sure they reach the disk (called with the lock held) """
+		if self.closed:
+			sequences: list = [record.get("sequence", record.get("segment", {}).get("sequence")) for record in records]
+			warning(f"Manifest '{os.path.basename(self.path)}' already closed, the records of the segments {sequences} are not saved")
+			return
+		self.file.write("".join(json.dumps(record, ensure_ascii = False) + "\n" for record in records))
+		self.file.flush()
+		os.fsync(self.file.fileno())
+
+	def add(self, source: str, start: float, end: float, audio_file: str|None = None, name: str|None = None, pcm: bytes|None = None, rate: int = ANALYSIS_RATE) -> Segment:
+		""" Register a new segment\n
+		Args:
+			source		(str):			Source of the segment (e.g. "recorder")
+			start		(float):		Start time of the segment (in seconds)
+			end			(float):		End time of the segment (in seconds)
+			audio_file	(str|None):		Path to the audio file if saved
+			name		(str|None):		Name of the segment, defaults to "<source>_<number of segments of this source>"
+			pcm			(bytes|None):	Audio of the segment (16-bit mono PCM) handed to the transcription without going through the disk
+			rate		(int):			Sample rate of the audio (Hz)
+		Returns:
+			Segment: The new segment
+		"""
+		with self.lock:
+			if name is None:
+				name = f"{source}_{self.count(source) + 1}"
+			record: dict = {"event": "add", "segment": {"sequence": len(self.segments), "source": source, "name": name, "start": round(start, 3), "end": round(end, 3), "audio_file": audio_file, "rate": rate}}
+			self.write(record)
+			self.apply(record)
+			self.segments[-1].pcm = pcm
+			return self.segments[-1]
+
+	def set_state(self, segment: Segment, state: str, transcript: str|None = None) -> None:
+		""" Update the state of a segment\n
+		Args:
+			segment		(Segment):		The segment to update
+			state		(str):			New state (TRANSCRIBED or MERGED)
+			transcript	(str|None):		Transcript of the segment (when it becomes TRANSCRIBED)
+		"""
+		with self.lock:
+			record: dict = {"event": "update", "sequence": segment.sequence, "state": state}
+			if transcript is not None:
+				record["transcript"] = transcript
+			self.write(record)
+			self.apply(record)
+
+	def count(self, source: str) -> int:
+		""" Get the number of segments of the given source """
+		return self.counts.get(source, 0)
+
+	def pending(self) -> list[Segment]:
+		""" Get the segments waiting for a transcript, ordered by sequence number """
+		with self.lock:
+			return sorted(self.pending_segments.values(), key = lambda segment: segment.sequence)
+
+	def to_merge(self) -> list[Segment]:
+		""" Get the transcribed segments that can be merged in order (stops at the first segment without a transcript) """
+		with self.lock:
+			segments: list[Segment] = []
+			for segment in self.segments[self.merge_cursor:]:
+				if segment.state != TRANSCRIBED:
+					break
+				segments.append(segment)
+			return segments
+
+	def mark_merged(self, segments: list[Segment]) -> None:
+		""" Mark the given segments (returned by to_merge()) as merged, with one write to the disk """
+		with self.lock:
+			records: list[dict] = [{"event": "update", "sequence": segment.sequence, "state": MERGED} for segment in segments]
+			self.write(*records)
+			for record in records:
+				self.apply(record)
+			self.merge_cursor += len(segments)
+
+	def close(self) -> None:
+		""" Close the manifest file, once the record being written (if any) is on the disk """
+		with self.lock:
+			self.closed = True
+			self.file.close()
+
+
+# Manifests of the sessions, by start time
+manifests: dict[str, SegmentManifest] = {}
+manifests_lock: threading.Lock = threading.Lock()
+def get_manifest(start_time: str) -> SegmentManifest:
+	""" Get the manifest of the session started at the given time, opening (or resuming) it if needed\n
+	Args:
+		start_time	(str):	Start time of the session
+	Returns:
+		SegmentManifest: The manifest of the session
+	"""
+	with manifests_lock:
+		if start_time not in manifests:
+			os.makedirs(TRANSCRIPT_FOLDER, exist_ok = True)
+			manifests[start_time] = SegmentManifest(f"{TRANSCRIPT_FOLDER}/manifest_{start_time}.jsonl", start_time)
+		return manifests[start_time]
+
+def close_manifest(start_time: str) -> None:
+	""" Close the manifest of the session started at the given time (before moving the session files)\n
+	Records being written are finished first, the ones arriving later are only kept in memory (with a warning).
+	"""
+	with manifests_lock:
+		manifest: SegmentManifest|None = manifests.pop(start_time, None)
+	if manifest is not None:
+		manifest.close()
+
+def read_segments(start_time: str) -> list[Segment]:
+	""" Get the segments of a session, from its open manifest or from its file (even after the session files were moved)\n
+	Args:
+		start_time	(str):	Start time of the session
+	Returns:
+		list[Segment]: Segments of the session, empty if the session is unknown
+	"""
+	with manifests_lock:
+		if start_time in manifests:
+			return list(manifests[start_time].segments)
+	for path in (f"{TRANSCRIPT_FOLDER}/manifest_{start_time}.jsonl", f"{TRANSCRIPT_FOLDER}/{start_time}/manifest_{start_time}.jsonl"):
+		if os.path.exists(path):
+			manifest: SegmentManifest = SegmentManifest(path, start_time)
+			manifest.close()
+			return manifest.segments
+	return []
+
+def find_last_session() -> str|None:
+	""" Get the start time of the last session that left a manifest in the transcript folder, if any """
+	if not os.path.exists(TRANSCRIPT_FOLDER):
+		return None
+	sessions: list[str] = [f[len("manifest_"):-len(".jsonl")] for f in os.listdir(TRANSCRIPT_FOLDER) if f.startswith("manifest_") and f.endswith(".jsonl")]
+	return max(sessions) if sessions else None
+
@@ -0,0 +1,164 @@
+
+## Imports
+from config import *
+from collections.abc import Iterator
+from contextlib import contextmanager
+import threading
+import bisect
+import time
+
+# Upper bounds of the histogram buckets
+TIME_BUCKETS: tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RATIO_BUCKETS: tuple[float, ...] = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0)
+
+# Histogram class to count observations by bucket
+class Histogram:
+	def __init__(self, buckets: tuple[float, ...] = TIME_BUCKETS):
+		self.buckets: tuple[float, ...] = buckets
+		self.counts: list[int] = [0] * (len(buckets) + 1)	# Last one is +Inf
+		self.count: int = 0
+		self.sum: float = 0.0
+
+	def observe(self, value: float) -> None:
+		self.counts[bisect.bisect_left(self.buckets, value)] += 1
+		self.count += 1
+		self.sum += value
+
+	def quantile(self, q: float) -> float:
+		""" Estimate a quantile from the buckets (upper bound of the bucket reaching it) """
+		target: float = q * self.count
+		total: int = 0
+		for bound, count in zip(self.buckets, self.counts):
+			total += count
+			if total >= target and total > 0:
+				return bound
+		return float("inf") if self.count else 0.0
+
+
+# Metrics class holding the counters, gauges and histograms of the application
+class Metrics:
+	def __init__(self, prefix: str = "autoreport"):
+		self.prefix: str = prefix
+		self.lock: threading.Lock = threading.Lock()
+		self.start_time: float = time.perf_counter()
+		self.counters: dict[tuple[str, tuple], float] = {}
+		self.gauges: dict[tuple[str, tuple], float] = {}
+		self.histograms: dict[tuple[str, tuple], Histogram] = {}
+		self.help: dict[str, str] = {}
+
+	def increment(self, name: str, amount: float = 1, **labels: str) -> None:
+		""" Add an amount to a counter """
+		key: tuple[str, tuple] = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			self.counters[key] = self.counters.get(key, 0) + amount
+
+	def set(self, name: str, value: float, **labels: str) -> None:
+		""" Set the value of a gauge """
+		with self.lock:
+			self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+	def add(self, name: str, amount: float, **labels: str) -> None:
+		""" Add an amount (possibly negative) to a gauge """
+		key: tuple[str, tuple] = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			self.gauges[key] = self.gauges.get(key, 0) + amount
+
+	def observe(self, name: str, value: float, buckets: tuple[float, ...] = TIME_BUCKETS, **labels: str) -> None:
+		""" Add an observation to a histogram """
+		key: tuple[str, tuple] = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			if key not in self.histograms:
+				self.histograms[key] = Histogram(buckets)
+			self.histograms[key].observe(value)
+
+	@contextmanager
+	def timer(self, name: str, **labels: str) -> Iterator[None]:
+		""" Observe the duration of the block (in seconds) in a histogram """
+		start: float = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(name, time.perf_counter() - start, **labels)
+
+	def describe(self, name: str, text: str) -> None:
+		""" Set the help text of a metric """
+		self.help[name] = text
+
+	@staticmethod
+	def format_labels(labels: tuple, extra: tuple = ()) -> str:
+		""" Format the labels of a sample, e.g. {source="recorder"} """
+		parts: list[str] = []
+		for key, value in (*labels, *extra):
+			value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+			parts.append(f'{key}="{value}"')
+		return "{" + ",".join(parts) + "}" if parts else ""
+
+	def to_prometheus(self) -> str:
+		""" Export every metric in the Prometheus text format\n
+		Returns:
+			str: The metrics, one sample per line
+		"""
+		lines: list[str] = []
+		described: set[str] = set()
+		def header(name: str, kind: str) -> None:
+			if name not in described:
+				described.add(name)
+				if name in self.help:
+					lines.append(f"# HELP {self.prefix}_{name} {self.help[name]}")
+				lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+
+		with self.lock:
+			self.gauges[("uptime_seconds", ())] = time.perf_counter() - self.start_time
+			for (name, labels), value in sorted(self.counters.items()):
+				header(name, "counter")
+				lines.append(f"{self.prefix}_{name}{self.format_labels(labels)} {value:g}")
+			for (name, labels), value in sorted(self.gauges.items()):
+				header(name, "gauge")
+				lines.append(f"{self.prefix}_{name}{self.format_labels(labels)} {value:g}")
+			for (name, labels), histogram in sorted(self.histograms.items(), key = lambda item: item[0]):
+				header(name, "histogram")
+				total: int = 0
+				for bound, count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+					total += count
+					lines.append(f"{self.prefix}_{name}_bucket{self.format_labels(labels, (('le', bound),))} {total}")
+				lines.append(f"{self.prefix}_{name}_sum{self.format_labels(labels)} {histogram.sum:g}")
+				lines.append(f"{self.prefix}_{name}_count{self.format_labels(labels)} {histogram.count}")
+		return "\n".join(lines) + "\n"
+
+	def summary(self) -> str:
+		""" Short human-readable summary of the histograms (count, mean and 95th percentile) """
+		with self.lock:
+			parts: list[str] = []
+			for (name, labels), histogram in sorted(self.histograms.items(), key = lambda item: item[0]):
+				if histogram.count:
+					label: str = ",".join(str(value) for _, value in labels)
+					parts.append(f"{name}{f'[{label}]' if label else ''}: n={histogram.count} mean={histogram.sum / histogram.count:.4f} p95<={histogram.quantile(0.95)}")
+		return " | ".join(parts)
+
+	def dump(self, path: str) -> None:
+		""" Write the metrics to a file in the Prometheus text format (replaced atomically) """
+		temporary: str = f"{path}.tmp"
+		with open(temporary, "w", encoding = "utf-8") as f:
+			f.write(self.to_prometheus())
+		os.replace(temporary, path)
+
+
+# Shared metrics of the application
+metrics: Metrics = Metrics()
+metrics.describe("capture_read_seconds", "Time to read the captured frames of a source")
+metrics.describe("silence_check_seconds", "Time of the voice activity detection of a chunk")
+metrics.describe("decode_seconds", "Time to decode a chunk of a compressed stream")
+metrics.describe("segment_cut_seconds", "Time to cut the sentences of a chunk (including the voice activity detection)")
+metrics.describe("echo_check_seconds", "Time to compare a recorder sentence with the playback audio")
+metrics.describe("echo_segments_total", "Recorder sentences dropped or partly muted because they were the playback audio")
+metrics.describe("archive_write_seconds", "Time to encode and write the audio of a sentence")
+metrics.describe("recognizer_seconds", "Time of a speech recognition call")
+metrics.describe("recognizer_realtime_factor", "Recognition time divided by the duration of the audio")
+metrics.describe("transcript_merge_seconds", "Time to append the new transcripts to the big transcript")
+metrics.describe("transcription_latency_seconds", "Time between a sentence being queued and its transcript being saved")
+metrics.describe("transcription_queue_depth", "Sentences queued or being transcribed")
+metrics.describe("segments_total", "Sentences cut from the audio")
+metrics.describe("forced_cuts_total", "Sentences cut because they reached the maximum duration")
+metrics.describe("segment_audio_seconds_total", "Duration of the audio of the sentences")
+metrics.describe("transcripts_total", "Transcripts saved")
+metrics.describe("transcript_cache_hits_total", "Transcripts found in the cache (recognition skipped)")
@@ -1,6 +1,13 @@
 
 # Imports
+from config import LOG_LEVEL, LOG_FILE, LOG_RATE_LIMIT, LOG_QUEUE_SIZE
+import threading
+import atexit
+import queue
+import json
 import time
+import sys
+import os
 
 # Colors constants
 GREEN = "\033[92m"
@@ -8,20 +15,136 @@ BLUE = "\033[94m"
 YELLOW = "\033[93m"
 RED = "\033[91m"
 RESET = "\033[0m"
+
+# Levels of the messages: severity and console prefix
+LEVELS: dict[str, tuple[int, str]] = {
+	"debug":	(10, f"{BLUE}[DEBUG"),
+	"info":		(20, f"{GREEN}[INFO "),
+	"warning":	(30, f"{YELLOW}[WARNING"),
+	"error":	(40, f"{RED}[ERROR"),
+}
+
 def current_time() -> str:
 	return time.strftime("%H:%M:%S")
+
+
+# Logger class to write the messages from a background thread (the callers never wait for the console or the disk)
+class Logger:
+	def __init__(self, level: str = LOG_LEVEL, path: str = LOG_FILE, rate_limit: int = LOG_RATE_LIMIT, max_pending: int = LOG_QUEUE_SIZE):
+		""" Start the writer thread\n
+		Args:
+			level		(str):	Minimum level of the messages written ("debug", "info", "warning" or "error")
+			path		(str):	Path of a JSON lines file receiving the messages too (empty to disable)
+			rate_limit	(int):	Maximum number of debug messages per second from the same line of code, the next ones are counted and skipped (0 to disable)
+			max_pending	(int):	Maximum number of messages waiting to be written, the next ones are dropped
+		"""
+		self.level: int = LEVELS[level][0]
+		self.path: str = path
+		self.rate_limit: int = rate_limit
+		self.dropped: int = 0											# Number of messages dropped because the queue was full
+		self.sites: dict[tuple[str, int], list] = {}					# Start of the current second, messages written and skipped, by line of code
+		self.lock: threading.Lock = threading.Lock()					# Guards the counters above (messages come from every thread)
+		self.queue: queue.Queue = queue.Queue(maxsize = max_pending)
+		self.thread: threading.Thread = threading.Thread(target = self.worker, name = "logger", daemon = True)
+		self.thread.start()
+		atexit.register(self.close)
+
+	def log(self, level: str, text: str, depth: int = 2) -> None:
+		""" Queue a message (returns immediately)\n
+		Args:
+			level	(str):	Level of the message (a key of LEVELS)
+			text	(str):	The message
+			depth	(int):	Number of frames between the line of code logging the message and this method (for the rate limit)
+		"""
+		if LEVELS[level][0] < self.level:
+			return
+		now: float = time.time()
+
+		# Rate limit the debug messages of each line of code (e.g. per-chunk messages), the other levels are always written
+		skipped: int = 0
+		if self.rate_limit > 0 and level == "debug":
+			frame = sys._getframe(depth)
+			site: tuple[str, int] = (frame.f_code.co_filename, frame.f_lineno)
+			with self.lock:
+				state: list|None = self.sites.get(site)
+				if state is None or now - state[0] >= 1.0:
+					skipped = state[2] if state else 0
+					self.sites[site] = [now, 1, 0]
+				elif state[1] < self.rate_limit:
+					state[1] += 1
+				else:
+					state[2] += 1
+					return
+
+		try:
+			self.queue.put_nowait((now, level, text, skipped, threading.current_thread().name))
+		except queue.Full:
+			with self.lock:
+				self.dropped += 1
+
+	def worker(self) -> None:
+		""" Write the queued messages until None is received """
+		file = None
+		if self.path:
+			try:
+				os.makedirs(os.path.dirname(self.path) or ".", exist_ok = True)
+				file = open(self.path, "a", encoding = "utf-8")
+			except OSError as e:
+				print(f"{YELLOW}[WARNING {current_time()}] Cannot open the log file '{self.path}': {e}{RESET}")
+
+		while (record := self.queue.get()) is not None:
+			moment, level, text, skipped, thread = record
+			if skipped:
+				text += f" ({skipped} similar messages skipped)"
+			with self.lock:
+				dropped, self.dropped = self.dropped, 0
+			if dropped:
+				text += f" ({dropped} messages dropped before this one)"
+			try:
+				print(f"{LEVELS[level][1]} {time.strftime('%H:%M:%S', time.localtime(moment))}] {text}{RESET}", flush = self.queue.empty())
+				if file is not None:
+					file.write(json.dumps({"time": round(moment, 3), "level": level, "thread": thread, "message": text}, ensure_ascii = False) + "\n")
+					if self.queue.empty():
+						file.flush()
+			except (OSError, ValueError):
+				pass
+			self.queue.task_done()
+
+		if file is not None:
+			file.close()
+		self.queue.task_done()
+
+	def flush(self) -> None:
+		""" Wait until every queued message is written """
+		if self.thread.is_alive():
+			self.queue.join()
+
+	def close(self, timeout: float = 2.0) -> None:
+		""" Write the remaining messages and stop the writer thread """
+		if self.thread.is_alive():
+			try:
+				self.queue.put(None, timeout = timeout)
+			except queue.Full:
+				return
+			self.thread.join(timeout)
+
+
+# Shared logger of the application
+logger: Logger = Logger()
+
 def info(text: str = "") -> None:
-	print(f"{GREEN}[INFO  {current_time()}] {text}{RESET}")
+	logger.log("info", text)
 def debug(text: str = "") -> None:
-	print(f"{BLUE}[DEBUG {current_time()}] {text}{RESET}")
+	logger.log("debug", text)
 def warning(text: str = "") -> None:
-	print(f"{YELLOW}[WARNING {current_time()}] {text}{RESET}")
+	logger.log("warning", text)
 def error(text: str = "", exit: bool = True) -> None:
-	print(f"{RED}[ERROR {current_time()}] {text}{RESET}")
-	if exit:
+	logger.log("error", text)
+
+	# Only ask the user when someone can answer (never from a worker thread, a server handler or without a terminal)
+	if exit and threading.current_thread() is threading.main_thread() and sys.stdin is not None and sys.stdin.isatty():
+		logger.flush()
 		try:
 			input("Press enter to ignore error and continue or 'CTRL+C' to stop the program... ")
 		except KeyboardInterrupt:
-			import sys
 			sys.exit(1)
-
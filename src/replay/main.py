@@ -0,0 +1,166 @@
+
+## Imports
+from config import *
+from src.print import *
+from src.segmenter import Segmenter
+from src.resampler import Resampler
+from src.stream_decoder import stream_file
+from src.speech_backends import BACKENDS, use_backend
+from src.audio_archive import get_archiver, close_archiver
+from src.transcript_utils import get_transcription_queue, make_the_report, close_the_big_transcript
+from src.transcription_queue import TranscriptionQueue
+from src.manifest import SegmentManifest, get_manifest
+from collections.abc import Iterator
+from datetime import datetime
+import argparse
+import struct
+import mmap
+import numpy as np
+
+
+# Function to find the audio data of a WAV file
+def parse_wav_header(data: mmap.mmap) -> tuple[int, int, int, int, int]|None:
+	""" Read the header of a WAV file mapped in memory\n
+	Args:
+		data	(mmap.mmap):	Content of the file
+	Returns:
+		tuple[int, int, int, int, int]|None: Number of channels, sample rate, bits per sample, offset and size of the audio data, None if the file is not a PCM WAV file
+	"""
+	if len(data) < 12 or data[0:4] != b"RIFF" or data[8:12] != b"WAVE":
+		return None
+	position: int = 12
+	channels, rate, bits = 0, 0, 0
+	while position + 8 <= len(data):
+		chunk_id: bytes = data[position:position + 4]
+		chunk_size: int = struct.unpack_from("<I", data, position + 4)[0]
+		if chunk_id == b"fmt ":
+			audio_format, channels, rate = struct.unpack_from("<HHI", data, position + 8)
+			bits = struct.unpack_from("<H", data, position + 22)[0]
+			if audio_format not in (1, 0xFFFE):		# PCM or WAVE_FORMAT_EXTENSIBLE
+				return None
+		elif chunk_id == b"data":
+			if not channels:
+				return None
+			return channels, rate, bits, position + 8, min(chunk_size, len(data) - position - 8)
+		position += 8 + chunk_size + (chunk_size & 1)
+	return None
+
+
+# Function to read a recording chunk by chunk
+def read_recording(path: str, chunk_duration: float = 10.0) -> Iterator[bytes]:
+	""" Read a recording as 16-bit mono PCM at ANALYSIS_RATE, in chunks so that memory usage does not depend on its length\n
+	16-bit WAV files are memory-mapped (only the pages being read are loaded), other formats are decoded by ffmpeg.\n
+	Args:
+		path			(str):		Path of the recording (WAV, FLAC, WebM, ...)
+		chunk_duration	(float):	Duration of the chunks (in seconds)
+	Returns:
+		Iterator[bytes]: Audio data (16-bit mono PCM at ANALYSIS_RATE), chunk by chunk
+	"""
+	with open(path, "rb") as f:
+		data: mmap.mmap = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+	try:
+		header: tuple[int, int, int, int, int]|None = parse_wav_header(data)
+		if header is None or header[2] != 16:
+			yield from stream_file(path, ANALYSIS_RATE, 2 * int(chunk_duration * ANALYSIS_RATE))
+			return
+		channels, rate, _, offset, size = header
+		resampler: Resampler|None = Resampler(rate, ANALYSIS_RATE) if rate != ANALYSIS_RATE else None
+		frame_bytes: int = 2 * channels
+		step: int = frame_bytes * int(chunk_duration * rate)
+		for start in range(offset, offset + size - size % frame_bytes, step):
+			count: int = min(step, offset + size - size % frame_bytes - start) // 2
+			samples: np.ndarray = np.frombuffer(data, np.int16, count = count, offset = start)
+			if channels > 1:
+				samples = (samples.reshape(-1, channels).sum(axis = 1, dtype = np.int32) // channels).astype(np.int16)
+			chunk: bytes = resampler.process(samples) if resampler else samples.tobytes()
+			del samples		# Release the view on the mapping
+			yield chunk
+	finally:
+		data.close()
+
+
+# Function to replay one recording
+def replay_file(path: str, manifest: SegmentManifest, transcription_queue: TranscriptionQueue, threshold: float = SILENCE_THRESHOLD, chunk_duration: float = 10.0, keep_audio: bool = False, offset: float = 0.0) -> float:
+	""" Cut a recording in sentences with the live segmenter and queue them for transcription\n
+	Args:
+		path				(str):					Path of the recording
+		manifest			(SegmentManifest):		Manifest of the session
+		transcription_queue	(TranscriptionQueue):	Transcription queue (blocks the reading when full)
+		threshold			(float):				RMS amplitude threshold of a voiced frame
+		chunk_duration		(float):				Duration of the chunks read from the file (in seconds)
+		keep_audio			(bool):					Save the audio of the sentences in the audio folder
+		offset				(float):				Time of the session (in seconds) at which the recording starts (duration of the previous recordings)
+	Returns:
+		float: Duration of the recording (in seconds)
+	"""
+	source: str = os.path.splitext(os.path.basename(path))[0].replace(" ", "_")
+	segmenter: Segmenter = Segmenter(ANALYSIS_RATE, threshold)
+
+	# Function to send a sentence to the transcription workers
+	def save(segment: tuple[bytes, float, float]) -> None:
+		pcm, start, end = segment
+		audio_file: str|None = get_archiver().submit(pcm, f"{source}_{manifest.count(source) + 1}", ANALYSIS_RATE, source) if keep_audio else None
+		transcription_queue.submit(manifest.add(source, offset + start, offset + end, audio_file, pcm = pcm, rate = ANALYSIS_RATE))
+
+	# Read the recording as fast as possible (the transcription queue applies the back-pressure)
+	for chunk in read_recording(path, chunk_duration):
+		for segment in segmenter.feed(chunk):
+			save(segment)
+	for segment in segmenter.flush():
+		save(segment)
+	return segmenter.position / ANALYSIS_RATE
+
+
+# Main function
+def replay_main(args: list[str]|None = None):
+	parser: argparse.ArgumentParser = argparse.ArgumentParser(description = "Transcribe existing recordings with the same pipeline as the live capture, as fast as possible")
+	parser.add_argument("files", nargs = "+", help = "Recordings to transcribe (WAV, FLAC, WebM, ...), in order")
+	parser.add_argument("--session", default = "", help = "Name of the session (used for the transcript and report files), defaults to the current time")
+	parser.add_argument("--threshold", type = float, default = SILENCE_THRESHOLD, help = f"RMS amplitude threshold of a voiced frame (default: {SILENCE_THRESHOLD})")
+	parser.add_argument("--chunk", type = float, default = 10.0, help = "Duration (in seconds) of the chunks read from the files (default: 10)")
+	parser.add_argument("--backend", choices = list(BACKENDS), default = SPEECH_BACKEND, help = f"Speech recognition backend (default: {SPEECH_BACKEND})")
+	parser.add_argument("--keep-audio", action = "store_true", help = "Save the audio of the sentences in the audio folder")
+	options: argparse.Namespace = parser.parse_args(args)
+
+	# Check the files
+	missing: list[str] = [path for path in options.files if not os.path.isfile(path)]
+	if missing:
+		error(f"Recordings not found: {', '.join(missing)}", exit = False)
+		return
+
+	# Make folders if they do not exist
+	for folder in [TRANSCRIPT_FOLDER, AUDIO_FOLDER, OUTPUT_FOLDER]:
+		os.makedirs(folder, exist_ok = True)
+
+	# Prepare the session
+	START_TIME: float = time.perf_counter()
+	session: str = options.session or datetime.now().strftime("%Y-%m-%d_%H-%M-%S") + "_replay"
+	use_backend(options.backend)
+	manifest: SegmentManifest = get_manifest(session)
+	transcription_queue: TranscriptionQueue = get_transcription_queue()
+	info(f"Replaying {len(options.files)} recording(s) in the session '{session}'")
+
+	# Cut the recordings and wait for the transcripts
+	duration: float = 0.0
+	for path in options.files:
+		file_start: float = time.perf_counter()
+		try:
+			file_duration: float = replay_file(path, manifest, transcription_queue, options.threshold, options.chunk, options.keep_audio, duration)
+		except Exception as e:
+			error(f"Error while replaying '{path}': {e}", exit = False)
+			continue
+		duration += file_duration
+		info(f"'{os.path.basename(path)}' cut in {time.perf_counter() - file_start:.2f}s ({file_duration:.2f}s of audio)")
+	transcription_queue.shutdown()
+	if options.keep_audio:
+		close_archiver()
+
+	# Make the big transcript and the report
+	make_the_report(session, not_final = False, keep_files = True)
+	close_the_big_transcript(session)
+
+	# End of the replay
+	elapsed: float = time.perf_counter() - START_TIME
+	stats: dict[str, float] = transcription_queue.stats()
+	info(f"Replayed {duration:.2f}s of audio in {elapsed:.2f}s ({duration / max(elapsed, 1e-9):.1f}x real time), {stats['delivered']} sentences transcribed (average latency: {stats['average_latency']:.2f}s)")
+	return
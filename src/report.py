@@ -0,0 +1,296 @@
+
+## Imports
+from config import *
+from src.print import *
+from src.manifest import Segment, SegmentManifest, get_manifest
+from src.transcript_cache import TranscriptCache
+from src.metrics import metrics
+import threading
+import hashlib
+import sqlite3
+import math
+import re
+
+# Patterns used by the extractive summarizer
+SENTENCE_PATTERN: re.Pattern = re.compile(r"(?<=[.!?])\s+")
+WORD_PATTERN: re.Pattern = re.compile(r"\w+")
+SPEAKER_PATTERN: re.Pattern = re.compile(r"^(\w+): (.*)$")
+
+# Base class of the summarizers
+class Summarizer:
+	name: str = "base"
+
+	@property
+	def identity(self) -> str:
+		""" Name of the summarizer and of its model (summaries of different identities are cached separately) """
+		return self.name
+
+	def summarize(self, text: str, sentences: int) -> str:
+		""" Summarize a part of the transcript\n
+		Args:
+			text		(str):	Transcript, one "Source: text" line per sentence (e.g. "Recorder: Hello everyone")
+			sentences	(int):	Maximum number of sentences of the summary
+		Returns:
+			str: The summary, one sentence per line
+		"""
+		raise NotImplementedError
+
+	def reduce(self, summaries: list[str], sentences: int) -> str:
+		""" Summarize the whole meeting from the summaries of its parts (by default, the summaries are summarized again)\n
+		Args:
+			summaries	(list[str]):	Summaries of the parts of the meeting, in order
+			sentences	(int):			Maximum number of sentences of the summary
+		Returns:
+			str: The summary, one sentence per line
+		"""
+		return self.summarize("\n".join(summaries), sentences)
+
+
+# Extractive summarizer (offline, keeps the sentences using the most frequent words of the text)
+class ExtractiveSummarizer(Summarizer):
+	name: str = "extractive"
+
+	def summarize(self, text: str, sentences: int) -> str:
+		# Split the lines in sentences, keeping the source of each one
+		candidates: list[tuple[str, str]] = []
+		for line in text.splitlines():
+			match: re.Match|None = SPEAKER_PATTERN.match(line.strip())
+			source, content = match.groups() if match else ("", line.strip())
+			candidates += [(source, sentence) for sentence in SENTENCE_PATTERN.split(content) if sentence]
+		if len(candidates) <= sentences:
+			return "\n".join(f"{source}: {sentence}" if source else sentence for source, sentence in candidates)
+
+		# Frequency of the words, short words are ignored (most of the stop words, whatever the language)
+		words: list[list[str]] = [[word.lower() for word in WORD_PATTERN.findall(sentence)] for _, sentence in candidates]
+		frequencies: dict[str, int] = {}
+		for sentence_words in words:
+			for word in sentence_words:
+				if len(word) > 3:
+					frequencies[word] = frequencies.get(word, 0) + 1
+		highest: int = max(frequencies.values(), default = 1)
+
+		# Score of a sentence: frequency of its words, not favoring long sentences too much
+		scores: list[float] = [
+			sum(frequencies.get(word, 0) for word in sentence_words) / (highest * math.sqrt(len(sentence_words))) if len(sentence_words) >= 4 else 0.0
+			for sentence_words in words
+		]
+		best: list[int] = sorted(sorted(range(len(candidates)), key = lambda i: scores[i], reverse = True)[:sentences])
+		return "\n".join(f"{candidates[i][0]}: {candidates[i][1]}" if candidates[i][0] else candidates[i][1] for i in best)
+
+
+# OpenAI summarizer (online, requires API keys)
+class OpenAISummarizer(Summarizer):
+	name: str = "openai"
+
+	def __init__(self):
+		from openai import OpenAI
+		if len(OPENAI_KEYS) == 0:
+			raise ValueError("No OpenAI API key provided, please add at least one key to the 'open_ai.keys' file")
+		self.client = OpenAI(api_key = OPENAI_KEYS[0])
+
+	@property
+	def identity(self) -> str:
+		return f"{self.name}:{REPORT_OPENAI_MODEL}"
+
+	def summarize(self, text: str, sentences: int) -> str:
+		response = self.client.chat.completions.create(
+			model = REPORT_OPENAI_MODEL,
+			messages = [
+				{"role": "system", "content": f"Summarize this part of a meeting transcript in at most {sentences} short sentences, one per line, in the language of the transcript."},
+				{"role": "user", "content": text},
+			],
+		)
+		return (response.choices[0].message.content or "").strip()
+
+
+# Available summarizers
+SUMMARIZERS: dict[str, type[Summarizer]] = {
+	summarizer.name: summarizer for summarizer in (ExtractiveSummarizer, OpenAISummarizer)
+}
+
+# Shared summarizer instance (created on first use)
+summarizer_instance: Summarizer|None = None
+summarizer_name: str = SUMMARIZER
+summarizer_lock: threading.Lock = threading.Lock()
+def get_summarizer() -> Summarizer:
+	""" Get the summarizer selected in the configuration (or with use_summarizer), creating it on first use\n
+	Returns:
+		Summarizer: The shared summarizer instance
+	"""
+	global summarizer_instance
+	with summarizer_lock:
+		if summarizer_instance is None:
+			if summarizer_name not in SUMMARIZERS:
+				raise ValueError(f"Unknown summarizer '{summarizer_name}', available summarizers: {', '.join(SUMMARIZERS)}")
+			summarizer_instance = SUMMARIZERS[summarizer_name]()
+		return summarizer_instance
+
+def use_summarizer(name: str) -> None:
+	""" Select another summarizer than the one of the configuration (created on first use)\n
+	Args:
+		name	(str):	Name of the summarizer (a key of SUMMARIZERS)
+	"""
+	global summarizer_instance, summarizer_name
+	if name not in SUMMARIZERS:
+		raise ValueError(f"Unknown summarizer '{name}', available summarizers: {', '.join(SUMMARIZERS)}")
+	with summarizer_lock:
+		if name != summarizer_name:
+			summarizer_name = name
+			summarizer_instance = None
+
+
+# Shared cache of the summaries (same key-value store as the transcripts, opened on first use)
+summary_cache: TranscriptCache|None = None
+summary_cache_enabled: bool = REPORT_CACHE
+summary_cache_lock: threading.Lock = threading.Lock()
+def get_summary_cache() -> TranscriptCache|None:
+	""" Get the shared summary cache\n
+	Returns:
+		TranscriptCache|None: The shared cache, None if disabled (or if the database cannot be opened)
+	"""
+	global summary_cache, summary_cache_enabled
+	with summary_cache_lock:
+		if summary_cache is None and summary_cache_enabled:
+			try:
+				summary_cache = TranscriptCache(REPORT_CACHE_PATH, REPORT_CACHE_SIZE)
+			except (sqlite3.Error, OSError) as e:
+				warning(f"Summary cache disabled, cannot open '{REPORT_CACHE_PATH}': {e}")
+				summary_cache_enabled = False
+		return summary_cache
+
+
+# Function to format a time of the meeting
+def format_time(seconds: float) -> str:
+	""" Format a time in seconds as "MM:SS" (or "H:MM:SS" after an hour) """
+	minutes, seconds = divmod(int(seconds), 60)
+	hours, minutes = divmod(minutes, 60)
+	return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+
+# ReportEngine class to build the report of a session incrementally
+class ReportEngine:
+	def __init__(self, start_time: str, summarizer: Summarizer|None = None, window: float = REPORT_WINDOW):
+		""" Initialize the report of a session\n
+		The transcript is split in windows of fixed duration, each window is summarized once (map),
+		and the summaries are summarized again into the summary of the meeting (reduce).
+		Only the windows receiving new transcripts are summarized again on the next update.\n
+		Args:
+			start_time	(str):			Start time of the session
+			summarizer	(Summarizer):	Summarizer to use (the shared one by default)
+			window		(float):		Duration (in seconds) of the windows
+		"""
+		self.start_time: str = start_time
+		self.manifest: SegmentManifest = get_manifest(start_time)
+		self.summarizer: Summarizer = summarizer or get_summarizer()
+		self.window: float = window
+		self.lock: threading.Lock = threading.Lock()
+		self.cursor: int = 0								# Number of merged segments already added to the windows
+		self.windows: dict[int, list[str]] = {}				# Lines of the transcript, by window index
+		self.summaries: dict[int, tuple[str, str]] = {}		# Key and summary, by window index
+		self.dirty: set[int] = set()						# Windows with new lines since their last summary
+		self.uncached: set[int] = set()						# Windows summarized while they were open (their summary is not in the cache)
+		self.latest: int = -1								# Index of the last window with transcripts (the open one, the previous ones are finished)
+		self.overview: tuple[str, str] = ("", "")			# Summaries of the windows it was made from and summary of the whole meeting
+
+	def collect(self) -> None:
+		""" Add the segments merged in the big transcript since the last update to their windows """
+		with self.manifest.lock:
+			segments: list[Segment] = self.manifest.segments[self.cursor:self.manifest.merge_cursor]
+		for segment in segments:
+			transcript: str = segment.transcript.strip()
+			if transcript:
+				index: int = int(segment.start // self.window)
+				self.windows.setdefault(index, []).append(f"{segment.source.title()}: {transcript}")
+				self.dirty.add(index)
+				self.latest = max(self.latest, index)
+		self.cursor += len(segments)
+
+	def summarize(self, text: str, sentences: int, parts: list[str]|None = None, cached: bool = True) -> tuple[str, str]:
+		""" Summarize a text (or the given summaries if parts is set), using the cache\n
+		Args:
+			text		(str):				Text to summarize (used for the key only if parts is set)
+			sentences	(int):				Maximum number of sentences of the summary
+			parts		(list[str]|None):	Summaries to reduce
+			cached		(bool):				Use the cache (False for a text that will change, e.g. the open window)
+		Returns:
+			tuple[str, str]: Key and summary
+		"""
+		key: str = hashlib.sha256(f"{self.summarizer.identity}:{sentences}:{parts is not None}:{text}".encode("utf-8")).hexdigest()
+		cache: TranscriptCache|None = get_summary_cache() if cached else None
+		summary: str|None = cache.get(key) if cache else None
+		if summary is None:
+			with metrics.timer("summary_seconds", stage = "reduce" if parts is not None else "map"):
+				summary = self.summarizer.reduce(parts, sentences) if parts is not None else self.summarizer.summarize(text, sentences)
+			if cache:
+				cache.put(key, summary)
+		return key, summary
+
+	def update(self, final: bool = False) -> str:
+		""" Summarize the windows with new transcripts and make the report\n
+		Args:
+			final	(bool):	True for the final report (the open window is considered finished)
+		Returns:
+			str: The report
+		"""
+		with self.lock:
+			self.collect()
+			for index in sorted(self.dirty):
+				finished: bool = final or index < self.latest
+				self.summaries[index] = self.summarize("\n".join(self.windows[index]), SUMMARY_SENTENCES, cached = finished)
+				if finished:
+					self.uncached.discard(index)
+				else:
+					self.uncached.add(index)
+			self.dirty.clear()
+
+			# Cache the summaries of the windows finished since they were summarized (without summarizing them again)
+			cache: TranscriptCache|None = get_summary_cache()
+			for index in [index for index in self.uncached if final or index < self.latest]:
+				if cache:
+					cache.put(*self.summaries[index])
+				self.uncached.discard(index)
+
+			# Reduce the summaries of the finished windows (only if they changed, so the open window never triggers it)
+			finished_windows: list[int] = [index for index in sorted(self.summaries) if final or index < self.latest]
+			parts: list[str] = [self.summaries[index][1] for index in finished_windows]
+			joined: str = "\n\n".join(parts)
+			if parts and self.overview[0] != joined:
+				self.overview = (joined, self.summarize(joined, REPORT_SENTENCES, parts)[1])
+			return self.render()
+
+	@staticmethod
+	def bullets(summary: str) -> str:
+		""" Format a summary as a Markdown list (one item per line) """
+		return "\n".join(f"- {line.strip()}" for line in summary.splitlines() if line.strip())
+
+	def render(self) -> str:
+		""" Make the report from the current summaries (Markdown) """
+		report: str = f"# Report of the session {self.start_time}\n\n## Summary\n{self.bullets(self.overview[1]) or f'- (made once the first {format_time(self.window)} of the meeting are transcribed)'}\n"
+		if self.summaries:
+			report += "\n## Timeline\n"
+			for index in sorted(self.summaries):
+				report += f"\n### {format_time(index * self.window)} - {format_time((index + 1) * self.window)}\n{self.bullets(self.summaries[index][1])}\n"
+		return report
+
+
+# Report engines, by start time
+report_engines: dict[str, ReportEngine] = {}
+engines_lock: threading.Lock = threading.Lock()
+def make_report(start_time: str, final: bool = False) -> str:
+	""" Update the report of a session with the transcripts merged since the last call\n
+	Args:
+		start_time	(str):	Start time of the session
+		final		(bool):	True for the final report (the last window is summarized as finished)
+	Returns:
+		str: The report
+	"""
+	with engines_lock:
+		if start_time not in report_engines:
+			report_engines[start_time] = ReportEngine(start_time)
+		engine: ReportEngine = report_engines[start_time]
+	return engine.update(final)
+
+def close_report(start_time: str) -> None:
+	""" Forget the report of a session (its summaries stay in the cache) """
+	with engines_lock:
+		report_engines.pop(start_time, None)
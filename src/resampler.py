@@ -0,0 +1,65 @@
+
+## Imports
+from config import *
+from src.vad import as_samples
+from math import gcd
+import numpy as np
+
+# Resampler class to change the sample rate of a PCM stream
+class Resampler:
+	def __init__(self, input_rate: int, output_rate: int = ANALYSIS_RATE, zero_crossings: int = 8):
+		""" Prepare a polyphase low-pass filter converting the input rate to the output rate (e.g. 48 kHz to 16 kHz)\n
+		The stream can be given in chunks of any size, the filter state is kept between the calls.\n
+		Args:
+			input_rate		(int):	Sample rate of the input (Hz)
+			output_rate		(int):	Sample rate of the output (Hz)
+			zero_crossings	(int):	Number of zero crossings of the windowed sinc on each side (quality of the filter)
+		"""
+		self.input_rate: int = input_rate
+		self.output_rate: int = output_rate
+		divisor: int = gcd(input_rate, output_rate)
+		self.up: int = output_rate // divisor
+		self.down: int = input_rate // divisor
+
+		# Windowed sinc at the upsampled rate, cut below the lowest of the two Nyquist frequencies
+		cutoff: float = 0.5 / max(self.up, self.down)
+		self.taps: int = 2 * zero_crossings * max(self.up, self.down) // self.up	# Number of taps per phase
+		length: int = self.taps * self.up
+		t: np.ndarray = np.arange(length) - (length - 1) / 2
+		prototype: np.ndarray = 2 * cutoff * np.sinc(2 * cutoff * t) * np.kaiser(length, 8.0) * self.up
+
+		# One row of taps per phase, reversed so that it applies to the input window in order
+		self.phases: np.ndarray = prototype.reshape(self.taps, self.up).T[:, ::-1].astype(np.float32)
+
+		# Stream state
+		self.history: np.ndarray = np.zeros(self.taps - 1, dtype = np.float32)	# Last input samples (needed by the next outputs)
+		self.input_count: int = 0													# Total number of input samples received
+		self.output_count: int = 0													# Total number of output samples produced
+
+	def process(self, data: bytes|memoryview|np.ndarray) -> bytes:
+		""" Resample a new chunk of the stream\n
+		Args:
+			data	(bytes|memoryview|np.ndarray):	Audio data (16-bit mono PCM at the input rate)
+		Returns:
+			bytes: Audio data (16-bit mono PCM at the output rate)
+		"""
+		samples: np.ndarray = as_samples(data)
+		if self.up == self.down:
+			return samples.tobytes()
+		buffer: np.ndarray = np.concatenate((self.history, samples.astype(np.float32)))
+		buffer_start: int = self.input_count - len(self.history)	# Position of buffer[0] in the stream
+		self.input_count += len(samples)
+
+		# Outputs whose last input sample is available
+		end: int = -(-self.input_count * self.up // self.down)
+		positions: np.ndarray = np.arange(self.output_count, end, dtype = np.int64) * self.down
+		self.output_count = end
+		self.history = buffer[len(buffer) - len(self.history):]
+		if len(positions) == 0:
+			return b""
+
+		# Each output is the dot product of its input window with the taps of its phase
+		windows: np.ndarray = np.lib.stride_tricks.sliding_window_view(buffer, self.taps)
+		window_index: np.ndarray = positions // self.up - buffer_start - (self.taps - 1)
+		output: np.ndarray = np.einsum("ij,ij->i", windows[window_index], self.phases[positions % self.up])
+		return np.clip(np.rint(output), -32768, 32767).astype(np.int16).tobytes()
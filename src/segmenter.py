@@ -0,0 +1,157 @@
+
+## Imports
+from config import *
+from src.vad import VoiceActivityDetector
+from src.metrics import metrics
+import numpy as np
+
+# Segmenter class to cut a PCM stream in sentences at the exact start of the silences
+class Segmenter:
+	def __init__(self, rate: int = ANALYSIS_RATE, threshold: float = SILENCE_THRESHOLD, silence_duration: float = SILENCE_DURATION, minimum_duration: float = MINIMUM_DURATION, maximum_duration: float = MAXIMUM_DURATION, pre_roll: float = PRE_ROLL, post_roll: float = POST_ROLL, lookback: float = CUT_LOOKBACK, overlap: float = CUT_OVERLAP):
+		""" Initialize the segmenter\n
+		Args:
+			rate				(int):		Sample rate (Hz)
+			threshold			(float):	RMS amplitude threshold of a voiced frame
+			silence_duration	(float):	Duration (in seconds) of the pause needed to end a sentence
+			minimum_duration	(float):	Minimum duration (in seconds) of a sentence, shorter ones are dropped
+			maximum_duration	(float):	Maximum duration (in seconds) of a sentence, longer ones are cut (so a sentence never uses more memory than that)
+			pre_roll			(float):	Duration (in seconds) of audio kept before the first voiced frame
+			post_roll			(float):	Duration (in seconds) of audio kept after the last voiced frame
+			lookback			(float):	Duration (in seconds) searched backwards for the quietest point of a sentence reaching the maximum duration
+			overlap				(float):	Duration (in seconds) of audio repeated at the start of the next segment after a forced cut
+		"""
+		self.rate: int = rate
+		self.detector: VoiceActivityDetector = VoiceActivityDetector(rate, threshold)
+		self.frame_bytes: int = 2 * self.detector.frame_size
+		self.silence_frames: int = max(1, round(silence_duration * rate / self.detector.frame_size))
+		self.minimum_bytes: int = 2 * int(minimum_duration * rate)
+		self.maximum_bytes: int = 2 * int(maximum_duration * rate)
+		self.pre_roll_bytes: int = 2 * int(pre_roll * rate)
+		self.post_roll_bytes: int = 2 * int(post_roll * rate)
+
+		# The look-back window and the overlap must leave room for new audio after a forced cut
+		self.lookback_frames: int = max(1, min(int(lookback * rate), int(maximum_duration * rate) // 2) // self.detector.frame_size)
+		self.overlap_bytes: int = 2 * min(int(overlap * rate), int(maximum_duration * rate) // 4)
+		self.smoothing_frames: int = max(1, min(self.lookback_frames, round(0.1 * rate / self.detector.frame_size)))	# The quietest point is searched on 100ms averages, not single frames
+
+		# Stream state
+		self.remainder: bytearray = bytearray()		# Incomplete frame waiting for more data
+		self.position: int = 0						# Position (in samples) of the next frame in the stream
+		self.pre_roll: bytearray = bytearray()		# Last audio received while no sentence is in progress
+		self.segment: bytearray = bytearray()		# Audio of the sentence in progress
+		self.segment_start: int|None = None			# Position (in samples) of the sentence in progress, None if there is none
+		self.silent_frames: int = 0					# Number of silent frames at the end of the sentence in progress
+		self.volume: float = 0.0					# RMS amplitude of the last audio received
+
+	@property
+	def in_speech(self) -> bool:
+		""" True if a sentence is in progress """
+		return self.segment_start is not None
+
+	def feed(self, data: bytes|memoryview) -> list[tuple[bytes, float, float]]:
+		""" Analyze the new audio frame by frame and cut the finished sentences\n
+		Args:
+			data	(bytes|memoryview):	New audio data (16-bit mono PCM)
+		Returns:
+			list[tuple[bytes, float, float]]: Finished sentences with their start and end time (in seconds since the start of the stream)
+		"""
+		# Only analyze complete frames, the rest is kept for the next call
+		self.remainder += data
+		size: int = len(self.remainder) - len(self.remainder) % self.frame_bytes
+		if size == 0:
+			return []
+		block: bytes = bytes(self.remainder[:size])
+		del self.remainder[:size]
+		with metrics.timer("silence_check_seconds"):
+			voiced, rms, _ = self.detector.analyze(block)
+		self.volume = float(np.sqrt(np.dot(rms, rms) / len(rms)))
+
+		# Go through the frames
+		segments: list[tuple[bytes, float, float]] = []
+		for i, is_voiced in enumerate(voiced):
+			frame: bytes = block[i * self.frame_bytes:(i + 1) * self.frame_bytes]
+			self.position += self.detector.frame_size
+
+			# No sentence in progress: start one on the first voiced frame, with the pre-roll
+			if not self.in_speech:
+				self.pre_roll += frame
+				if is_voiced:
+					self.segment = self.pre_roll
+					self.segment_start = self.position - len(self.pre_roll) // 2
+					self.pre_roll = bytearray()
+					self.silent_frames = 0
+				elif len(self.pre_roll) > self.pre_roll_bytes:
+					del self.pre_roll[:len(self.pre_roll) - self.pre_roll_bytes]
+				continue
+
+			# Sentence in progress
+			self.segment += frame
+			self.silent_frames = 0 if is_voiced else self.silent_frames + 1
+
+			# End the sentence at the start of the silence (plus the post-roll)
+			if self.silent_frames >= self.silence_frames:
+				silence_start: int = len(self.segment) - self.silent_frames * self.frame_bytes
+				self.cut(min(len(self.segment), silence_start + self.post_roll_bytes), segments)
+
+			# Force a cut if the sentence is too long, the sentence continues in a new segment
+			elif len(self.segment) >= self.maximum_bytes:
+				self.force_cut(segments)
+		return segments
+
+	def quietest_point(self) -> int:
+		""" Find the quietest point in the look-back window at the end of the sentence in progress\n
+		Returns:
+			int: Position (in bytes) in the sentence of the quietest point (on a frame boundary)
+		"""
+		frames: int = min(self.lookback_frames, len(self.segment) // self.frame_bytes)
+		offset: int = len(self.segment) - frames * self.frame_bytes
+		samples: np.ndarray = np.frombuffer(bytes(self.segment[offset:]), dtype = np.int16).astype(np.float32).reshape(frames, self.detector.frame_size)
+		energy: np.ndarray = np.einsum("ij,ij->i", samples, samples)
+		width: int = min(self.smoothing_frames, frames)
+		smoothed: np.ndarray = np.convolve(energy, np.ones(width, dtype = np.float32), mode = "valid")
+		return offset + (int(np.argmin(smoothed)) + width // 2) * self.frame_bytes
+
+	def force_cut(self, segments: list[tuple[bytes, float, float]]) -> None:
+		""" Cut the sentence in progress at its quietest point in the look-back window\n
+		The sentence continues in a new segment starting a little before the cut, so that a word at the cut is in both segments.\n
+		Args:
+			segments	(list[tuple[bytes, float, float]]):		List of finished sentences to complete
+		"""
+		size: int = self.quietest_point()
+		start: float = self.segment_start / self.rate
+		segments.append((bytes(self.segment[:size]), start, start + size / (2 * self.rate)))
+		metrics.increment("forced_cuts_total")
+
+		# Keep the overlap and the audio after the cut as the start of the next segment
+		kept_from: int = max(0, size - self.overlap_bytes)
+		del self.segment[:kept_from]
+		self.segment_start += kept_from // 2
+		self.silent_frames = min(self.silent_frames, len(self.segment) // self.frame_bytes)
+
+	def cut(self, size: int, segments: list[tuple[bytes, float, float]]) -> None:
+		""" End the sentence in progress after 'size' bytes, adding it to the segments if it is long enough\n
+		Args:
+			size		(int):									Number of bytes of the sentence to keep
+			segments	(list[tuple[bytes, float, float]]):		List of finished sentences to complete
+		"""
+		start: float = self.segment_start / self.rate
+		if size >= self.minimum_bytes:
+			segments.append((bytes(self.segment[:size]), start, start + size / (2 * self.rate)))
+
+		# What follows the sentence becomes the pre-roll of the next one
+		self.pre_roll = self.segment[max(size, len(self.segment) - self.pre_roll_bytes):]
+		self.segment = bytearray()
+		self.segment_start = None
+		self.silent_frames = 0
+
+	def flush(self) -> list[tuple[bytes, float, float]]:
+		""" End the sentence in progress (at the end of the stream)\n
+		Returns:
+			list[tuple[bytes, float, float]]: The last sentence if it is long enough
+		"""
+		segments: list[tuple[bytes, float, float]] = []
+		if self.in_speech:
+			silence_start: int = len(self.segment) - self.silent_frames * self.frame_bytes
+			self.cut(min(len(self.segment), silence_start + self.post_roll_bytes), segments)
+		return segments
+
@@ -2,16 +2,17 @@
 ## Imports
 from config import *
 from src.print import *
-from src.silence import *
-from src.folder_utils import move_transcripts_and_audio_files
+from src.folder_utils import move_transcripts_and_audio_files, list_files, stream_zip
 from src.transcript_utils import *
+from src.server.session import ServerSession, transcript_delta
+from src.manifest import PENDING, Segment, read_segments
+from src.audio_archive import close_archiver
+from src.metrics import metrics
 from datetime import datetime
-import zipfile
-import pydub
 import os
-import io
+import re
 
-from flask import Flask
+from flask import Flask, Response, request, stream_with_context
 from flask_talisman import Talisman
 from flask_socketio import SocketIO, emit
 
@@ -39,102 +40,130 @@ csp = {
 app: Flask = Flask(__name__)
 Talisman(app, force_https=True, content_security_policy=csp)
 socketio: SocketIO = SocketIO(app, cors_allowed_origins="*")
-joined_chunks: bytes = b''						# To accumulate audio chunks (mimeType received from the client)
-metadata_chunk: bytes = b''						# The metadata chunk, only used for the first chunk
-total_audio_duration: float = 0.0				# Total duration of the audio
-start_audio_time: float = 0.0					# Start time of the audio (updated when the audio is saved to not save the same audio multiple times)
-mimeType: str = "audio/webm"					# MIME type of the audio (webm format by default)
+sessions: dict[str, ServerSession] = {}			# Sessions of the connected clients, by Socket.IO session id
+SESSION_ID_PATTERN: re.Pattern = re.compile(r"\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}_[\w-]{1,16}")	# Id of a session: start time and connection
+closing: dict[str, ServerSession] = {}			# Sessions of the disconnected clients still finishing their transcripts, by session id
 START_TIME: float = time.perf_counter()			# Start time of the application
 START_TIME_STR = datetime.now().strftime("%Y-%m-%d") + "_" + time.strftime("%H-%M-%S", time.localtime(START_TIME))
 SERVER_FOLDER: str = os.path.dirname(os.path.abspath(__file__)).replace("\\", "/")
 
 # Get index page
 with open(f"{SERVER_FOLDER}/index.html", "r") as f:
-	INDEX_PAGE: str = f.read().replace("__SLEEP_INTERVAL__", str(int(SLEEP_INTERVAL * 1000)))
+	INDEX_PAGE: str = f.read().replace("__SLEEP_INTERVAL__", str(int(SLEEP_INTERVAL * 1000))).replace("__PCM_RATE__", str(PCM_RATE))
+with open(f"{SERVER_FOLDER}/pcm_worklet.js", "r") as f:
+	PCM_WORKLET: str = f.read()
 
 # Variables for silence detection
-current_threshold: int = -60					# Current threshold for silence detection
-not_initialized_silence: int = -10000000		# Value to avoid saving the same silence multiple times
-silence_counter: int = not_initialized_silence	# Counter for the silence detection
-total_files: int = 0							# Total number of files saved
+DEFAULT_THRESHOLD: int = -60					# Threshold for silence detection of new sessions (in dB)
 info(f"Server started at {START_TIME_STR}, minimum duration: {MINIMUM_DURATION}s, maximum duration: {MAXIMUM_DURATION}s")
 
 
-# Function to convert mimeType frames to wav
-def convert_to_wav(frames: bytes, start_duration: float = 0.0) -> tuple[bytes, float]:
-	""" Convert the frames of mimeType to wav
-	Args:
-		frames			(bytes):	Audio frames
-		start_duration	(float):	Start duration of the audio
-	Returns:
-		tuple[bytes, float]:		Wav frames and the duration of the audio
-	"""
-	bytes_io: io.BytesIO = io.BytesIO(frames)
-	audio: pydub.AudioSegment = pydub.AudioSegment.from_file(bytes_io, format=mimeType.split('/')[-1], start_second=start_duration)
-	with io.BytesIO() as output:
-		audio.export(output, format="wav")
-		return output.getvalue(), audio.duration_seconds
-
 @app.route('/')
 def index():
 	return INDEX_PAGE
 
+@app.route('/pcm_worklet.js')
+def pcm_worklet():
+	""" AudioWorklet used by the page to send raw 16 kHz PCM """
+	return Response(PCM_WORKLET, mimetype = "application/javascript")
+
+@app.route('/metrics')
+def metrics_route():
+	""" Latency and throughput metrics of every stage, in the Prometheus text format """
+	metrics.set("sessions", len(sessions))
+	return Response(metrics.to_prometheus(), mimetype = "text/plain; version=0.0.4")
+
+# Function to get the session targeted by an HTTP request
+def get_session() -> ServerSession|None:
+	""" Get the session given by the "session" query parameter (its id or Socket.IO session id), or the last connected one """
+	session_id: str|None = request.args.get("session")
+	for session in reversed(list(sessions.values())):
+		if not session_id or session_id in (session.id, session.sid):
+			return session
+	return None
+
 @app.route('/new_iteration')
 def new_iteration():
-	""" Move all the transcripts to a subfolder and update the start time """
-	global START_TIME
-	global START_TIME_STR
-
-	# Move every transcript and audio files in subfolders
-	move_transcripts_and_audio_files(START_TIME, START_TIME_STR)
-
-	# Update the start time
-	old_start_time: str = START_TIME_STR
-	START_TIME = time.perf_counter()			# Start time of the application
-	START_TIME_STR = datetime.now().strftime("%Y-%m-%d") + "_" + time.strftime("%H-%M-%S", time.localtime(START_TIME))
-
-	# Return the message
-	return f"Start time updated from {old_start_time} to {START_TIME_STR}!"
+	""" Move the transcripts of the session to a subfolder and start a new iteration """
+	session: ServerSession|None = get_session()
+	if session is None:
+		return "No session found!", 404
+	with session.lock:
+		old_start_time: str = session.new_iteration()
+	return f"Start time updated from {old_start_time} to {session.id}!"
 
 @app.route('/request_report')
 def request_report():
-	""" Request the report to be generated and send to the client """
-	return make_the_report(START_TIME_STR, not_final = True)
+	""" Request the report of the session to be generated and send to the client (only for the connected sessions) """
+	session: ServerSession|None = get_session()
+	if session is None:
+		return "No session found!", 404
+	return make_the_report(session.id, not_final = True)
 
 @app.route('/request_outputs')
 def request_outputs():
-	""" Request the outputs to be sent to the client (everything in the output folder) """
-	# Prepare a zip file with the outputs
-	output_zip: str = f"{OUTPUT_FOLDER}/outputs_{START_TIME_STR}.zip"
-	with zipfile.ZipFile(output_zip, 'w') as zipf:
-		for root, _, files in os.walk(OUTPUT_FOLDER):
-			for file in files:
-				if not file.endswith(".zip"):
-					zipf.write(os.path.join(root, file), os.path.relpath(os.path.join(root, file), OUTPUT_FOLDER))
-	with open(output_zip, "rb") as f:
-		to_return: str = f.read()
-	
-	# Remove the zip file
-	os.remove(output_zip)
-
-	# Return the zip file content
-	return to_return
+	""" Request the outputs to be sent to the client (everything in the output folder), as a zip file streamed chunk by chunk\n
+	Query parameters:
+		session	(str):	Only send the files of the session started at this time (e.g. "2024-01-31_14-00-00")
+		audio	(str):	If "1", also send the audio files (stored uncompressed in the zip file)
+	"""
+	session: str|None = request.args.get("session") or None
+	files: list[tuple[str, str]] = list_files(OUTPUT_FOLDER, session)
+	if request.args.get("audio") == "1":
+		files += list_files(AUDIO_FOLDER, session, prefix = "audio/")
+
+	# Stream the zip file
+	return Response(
+		stream_with_context(stream_zip(files)),
+		mimetype = "application/zip",
+		headers = {"Content-Disposition": f"attachment; filename=outputs_{session or START_TIME_STR}.zip"}
+	)
 
 @socketio.on('connect')
 def handle_connect():
-	new_iteration()
-	global joined_chunks, total_audio_duration, start_audio_time, silence_counter, metadata_chunk
-	joined_chunks = b""
-	metadata_chunk = b""
-	total_audio_duration = 0.0
-	start_audio_time = 0.0
-	silence_counter = not_initialized_silence
-	print("Client connected")
-	emit('threshold', current_threshold)	# Send the current threshold to the client
+	sid: str = request.sid
+	session: ServerSession = ServerSession(sid, DEFAULT_THRESHOLD, lambda delta: socketio.emit('transcript_delta', delta, to = session.listener), socketio.start_background_task)
+	sessions[sid] = session
+	info(f"Client connected (session '{session.id}', {len(sessions)} connected)")
+	emit('session', session.id)				# Send the id of the session to the client
+	emit('threshold', session.threshold)	# Send the current threshold to the client
 
 @socketio.on('disconnect')
 def handle_disconnect():
-	print("Client disconnected")
+	session: ServerSession|None = sessions.pop(request.sid, None)
+	if session is not None:
+		closing[session.id] = session
+
+		# Function to close the session in the background (its last transcripts can still be sent if the client resyncs)
+		def close_session() -> None:
+			session.close()
+			closing.pop(session.id, None)
+		socketio.start_background_task(close_session)
+	info(f"Client disconnected ({len(sessions)} connected)")
+
+@socketio.on('resync')
+def handle_resync(state: dict):
+	""" Send the transcripts of a session that the client missed (e.g. after a reconnection), and forward the next ones to this client
+	if the session is closing (its client disconnected)\n
+	Args:
+		state (dict): Last session and sequence number received by the client, e.g. {"session": "2024-01-31_14-00-00_abcd1234", "after": 12}
+	"""
+	session_id: object = state.get("session") if isinstance(state, dict) else None
+	after: object = state.get("after", -1) if isinstance(state, dict) else None
+	if not isinstance(session_id, str) or not SESSION_ID_PATTERN.fullmatch(session_id) or not isinstance(after, int) or isinstance(after, bool):
+		warning(f"Invalid resync request received: {state}")
+		emit('error', "Invalid resync request, expected {\"session\": <session id>, \"after\": <sequence number>}")
+		return
+
+	# Forward the next transcripts of the session to this client only if its own client is gone (a live session keeps its listener)
+	session: ServerSession|None = closing.get(session_id)
+	if session is not None:
+		session.listener = request.sid
+
+	# Send the missed transcripts (the client ignores the ones it already has)
+	segments: list[Segment] = [s for s in read_segments(session_id) if s.sequence > after and s.state != PENDING]
+	emit('transcript_resync', transcript_delta(session_id, segments))
+	info(f"Client resynced on the session '{session_id}' ({len(segments)} missed transcripts)")
 
 @socketio.on('mimeType')
 def handle_mimeType(mime: str):
@@ -142,9 +171,10 @@ def handle_mimeType(mime: str):
 	Args:
 		mime (str): MIME type of the audio
 	"""
-	global mimeType
-	mimeType = mime
-	info(f"New MIME type received: {mimeType}")
+	session: ServerSession = sessions[request.sid]
+	with session.lock:
+		session.set_mime_type(mime)
+	info(f"New MIME type received for the session '{session.id}': {mime}")
 
 @socketio.on('update_threshold')
 def handle_update_threshold(threshold: str):
@@ -152,89 +182,83 @@ def handle_update_threshold(threshold: str):
 	Args:
 		threshold (int): New threshold for silence detection
 	"""
-	global current_threshold
-	current_threshold = int(threshold)
-	info(f"New threshold received: {current_threshold} dB")
+	session: ServerSession = sessions[request.sid]
+	with session.lock:
+		session.set_threshold(int(threshold))
+	info(f"New threshold received for the session '{session.id}': {threshold} dB")
 
 
-@socketio.on('audio_stream')
-def handle_audio_stream(frames: bytes):
-	""" Accumulate the incoming audio data
+# Function to handle the sentences cut from a session
+def handle_segments(session: ServerSession, segments: list[tuple[bytes, float, float]]) -> None:
+	""" Send the volume to the client and queue the finished sentences
 	Args:
-		frames (bytes): Audio data
+		session		(ServerSession):						Session of the client
+		segments	(list[tuple[bytes, float, float]]):		Finished sentences with their start and end time (in seconds)
 	"""
-	global silence_counter, joined_chunks, total_files, total_audio_duration, start_audio_time, metadata_chunk
-
-	# If this is the first chunk, save the metadata
-	if not metadata_chunk:
-		metadata_chunk = frames
-
-	# Convert the audio to wav
-	try:
-		converted_frames, duration = convert_to_wav(joined_chunks + frames, start_duration = total_audio_duration)
-		total_audio_duration += duration
-	except Exception as e:
-		# If an error occurs, reset everything and send errors to the client
-		error(f"Error while converting the audio to wav: {e}", exit = False)
-		silence_counter = not_initialized_silence
-		joined_chunks = b""
-		total_audio_duration = 0.0
-		start_audio_time = 0.0
-		emit('error', str(e))
-		return
-
-	# Accumulate the audio frames (mimeType received from the client)
-	joined_chunks += frames
-
-	# Check if the audio is silent
-	silence, volume = is_silent_wav_bytes(converted_frames, current_threshold)
-	if silence:
-		if silence_counter != not_initialized_silence:
-			silence_counter += duration		# Add the duration to the silence counter
-			if DEBUG_MODE:
-				debug(f"Silence detected (counter: {silence_counter})")
-		else:
-			# Do not register the silence at the beginning of the audio (when silence_counter == not_initialized_silence)
-			start_audio_time = total_audio_duration
-	else:
-		silence_counter = 0
-		if DEBUG_MODE:
-			debug(f"Audio detected (adding {len(frames)} chunks to join, now {len(joined_chunks)} chunks)")
-	
 	# Send the volume to the client
-	emit('volume', volume)
+	emit('volume', session.volume)
+	if DEBUG_MODE and session.segmenter.in_speech:
+		debug(f"Audio detected on the session '{session.id}' ({len(session.segmenter.segment) / (2 * session.rate):.2f}s in the current sentence)")
 
-	# Check if the silence duration is reached, or the maximum duration is reached
-	this_chunk_duration: float = (total_audio_duration - start_audio_time)
-	if silence_counter >= SILENCE_DURATION or this_chunk_duration >= MAXIMUM_DURATION:
-		silence_counter = not_initialized_silence		# Reset the silence counter
+	# Export and transcribe the sentences in the background, the transcript is sent when ready
+	if segments:
+		session.save(segments)
 
-		# If the minimum duration is reached, save the audio to a file
-		if this_chunk_duration >= MINIMUM_DURATION:
-
-			# Get the audio data as cutted from the start time
-			bytes_io: io.BytesIO = io.BytesIO(joined_chunks)
-			audio_segment: pydub.AudioSegment = pydub.AudioSegment.from_file(bytes_io, format=mimeType.split('/')[-1], start_second=start_audio_time)
+@socketio.on('audio_stream')
+def handle_audio_stream(frames: bytes):
+	""" Decode the incoming audio data once and cut the finished sentences
+	Args:
+		frames (bytes): Audio data
+	"""
+	session: ServerSession = sessions[request.sid]
+	with session.lock:
+
+		# Feed the chunk to the streaming decoder and the segmenter
+		try:
+			segments: list[tuple[bytes, float, float]] = session.ingest(frames)
+		except Exception as e:
+			# If an error occurs, reset everything and send errors to the client
+			error(f"Error while decoding the audio stream of the session '{session.id}': {e}", exit = False)
+			session.reset()
+			emit('error', str(e))
+			return
+		handle_segments(session, segments)
+
+@socketio.on('pcm_format')
+def handle_pcm_format(pcm_format: dict):
+	""" Switch the session to raw PCM ingest
+	Args:
+		pcm_format (dict): Format of the PCM, e.g. {"rate": 16000} (16-bit mono)
+	"""
+	session: ServerSession = sessions[request.sid]
 
-			# Save the audio to a file
-			total_files += 1
-			audio_file: str = f"{AUDIO_FOLDER}/server_{total_files}.wav"
-			audio_segment.export(audio_file, format="wav")
-			info(f"Audio file '{os.path.basename(audio_file)}' saved successfully! Now transcribing...")
+	# Only accept the usual sample rates (multiples of 25 Hz keep the filter of the resampler small)
+	rate: object = pcm_format.get("rate", PCM_RATE) if isinstance(pcm_format, dict) else None
+	if not isinstance(rate, int) or isinstance(rate, bool) or not (PCM_MIN_RATE <= rate <= PCM_MAX_RATE) or rate % 25 != 0:
+		warning(f"Invalid PCM format received for the session '{session.id}': {pcm_format}")
+		emit('error', f"Unsupported PCM format {pcm_format}, the rate must be a multiple of 25 Hz between {PCM_MIN_RATE} and {PCM_MAX_RATE} Hz")
+		return
+	with session.lock:
+		session.set_pcm_format(rate)
+	info(f"Session '{session.id}' now sends raw PCM at {rate} Hz")
 
-			# Reset the start time of the audio, and the joined chunks
-			start_audio_time = total_audio_duration
-			joined_chunks = metadata_chunk	# Resets to the metadata chunk
+@socketio.on('pcm_stream')
+def handle_pcm_stream(pcm: bytes):
+	""" Cut the finished sentences of the incoming raw PCM (16-bit mono)
+	Args:
+		pcm (bytes): Audio data
+	"""
+	session: ServerSession = sessions[request.sid]
+	with session.lock:
+		if not session.pcm_mode:
+			emit('error', "Raw PCM received before its format ('pcm_format' event)")
+			return
+		handle_segments(session, session.ingest_pcm(pcm))
 
-			# Get the big transcript and send it to the client
-			emit('transcript', manage_new_audios(START_TIME_STR).strip())
-		
 
 
 # Main function
 def server_main():
-	global START_TIME, START_TIME_STR
-
 	# If OpenAI API is used but no key is provided, exit the application
 	if USE_OPENAI_API and len(OPENAI_KEYS) == 0:
 		error("No OpenAI API key provided, please add at least one key to the 'open_ai.keys' file or disable the API in the configuration file")
@@ -249,6 +273,7 @@ def server_main():
 
 	# Start the main loop
 	socketio.run(app, host=SERVER_HOST, port=SERVER_PORT, ssl_context="adhoc")
+	close_archiver()
 
 	# Move every transcript and audio files in subfolders
 	move_transcripts_and_audio_files(START_TIME, START_TIME_STR)
@@ -0,0 +1,45 @@
+
+// AudioWorklet processor converting the microphone input to 16-bit mono PCM at a lower sample rate
+class PcmProcessor extends AudioWorkletProcessor {
+	constructor(options) {
+		super();
+		this.ratio = sampleRate / options.processorOptions.targetRate;		// Number of input samples per output sample
+		this.position = 0;			// Position in the current output sample (in input samples)
+		this.sum = 0;				// Sum of the input samples of the current output sample
+		this.count = 0;				// Number of input samples of the current output sample
+		this.buffer = new Int16Array(Math.ceil(options.processorOptions.targetRate * options.processorOptions.batchDuration));
+		this.length = 0;			// Number of samples in the buffer
+	}
+
+	process(inputs) {
+		const input = inputs[0];
+		if (input.length === 0) {
+			return true;
+		}
+
+		// Downsample the first channel by averaging the input samples of each output sample
+		const channel = input[0];
+		for (let i = 0; i < channel.length; i++) {
+			this.sum += channel[i];
+			this.count++;
+			this.position++;
+			if (this.position >= this.ratio) {
+				this.position -= this.ratio;
+				const sample = Math.max(-1, Math.min(1, this.sum / this.count));
+				this.buffer[this.length++] = sample < 0 ? sample * 0x8000 : sample * 0x7FFF;
+				this.sum = 0;
+				this.count = 0;
+
+				// Send the buffer to the page when full (transferred, not copied)
+				if (this.length === this.buffer.length) {
+					this.port.postMessage(this.buffer.buffer, [this.buffer.buffer]);
+					this.buffer = new Int16Array(this.buffer.length);
+					this.length = 0;
+				}
+			}
+		}
+		return true;
+	}
+}
+
+registerProcessor('pcm-processor', PcmProcessor);
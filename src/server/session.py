@@ -0,0 +1,219 @@
+
+## Imports
+from config import *
+from src.print import *
+from src.folder_utils import move_session_files
+from src.transcript_utils import close_the_big_transcript, update_the_big_transcript, save_transcript, transcribe_segment
+from src.transcription_queue import TranscriptionQueue
+from src.audio_archive import get_archiver
+from src.stream_decoder import StreamDecoder
+from src.manifest import Segment, SegmentManifest, get_manifest
+from src.segmenter import Segmenter
+from src.resampler import Resampler
+from src.vad import amplitude_to_dbfs, dbfs_to_amplitude
+from src.metrics import metrics
+from collections.abc import Callable
+from datetime import datetime
+import threading
+import queue
+
+# Element ids marking the start of a WebM stream (EBML header) and of its audio data (first cluster)
+EBML_HEADER: bytes = b"\x1a\x45\xdf\xa3"
+WEBM_CLUSTER: bytes = b"\x1f\x43\xb6\x75"
+
+# Function to start a background thread (default way to start the background tasks of a session)
+def start_thread(target: Callable) -> threading.Thread:
+	thread: threading.Thread = threading.Thread(target = target, daemon = True)
+	thread.start()
+	return thread
+
+# Function to describe transcribed segments for the client
+def transcript_delta(session_id: str, segments: list[Segment]) -> dict:
+	""" Build the message sent to the client for new transcripts (only the new segments, not the whole transcript)\n
+	Args:
+		session_id	(str):				Id of the session (start time of the iteration)
+		segments	(list[Segment]):	Transcribed segments, in order
+	Returns:
+		dict: The session id and, for each segment, its sequence number, source, times and text
+	"""
+	return {
+		"session": session_id,
+		"segments": [{"sequence": s.sequence, "source": s.source, "start": s.start, "end": s.end, "text": s.transcript.strip()} for s in segments],
+	}
+
+# ServerSession class holding the state of one connected recorder
+class ServerSession:
+	def __init__(self, sid: str, threshold: int = -60, on_transcript: Callable[[dict], None]|None = None, start_task: Callable|None = None):
+		""" Initialize the session of a new connection and start its background export task\n
+		Args:
+			sid				(str):			Socket.IO session id of the connection
+			threshold		(int):			Threshold for silence detection (in dB)
+			on_transcript	(Callable):		Function receiving the new transcripts (see transcript_delta) each time some are ready (called from a worker thread)
+			start_task		(Callable):		Function starting a background task, e.g. socketio.start_background_task (a thread by default)
+		"""
+		self.sid: str = sid
+		self.listener: str = sid							# Socket.IO session id receiving the transcripts (changes if the client reconnects)
+		self.lock: threading.Lock = threading.Lock()		# Chunks of a session are handled one at a time
+		self.mime_type: str = "audio/webm"					# MIME type of the audio (webm format by default)
+		self.pcm_mode: bool = False							# True if the client sends raw PCM instead of a compressed stream
+		self.rate: int = ANALYSIS_RATE						# Sample rate of the PCM given to the segmenter
+		self.resampler: Resampler|None = None				# Resampler of the raw PCM if it is not sent at ANALYSIS_RATE
+		self.threshold: int = threshold
+		self.decoder: StreamDecoder|None = None				# Streaming decoder (started on the first chunk)
+		self.header: bytes = b""							# Header of the compressed stream (first chunk), fed to every new decoder
+		self.segmenter: Segmenter|None = None				# Segmenter of the PCM (16-bit mono at self.rate)
+		self.id: str = ""
+		self.new_iteration()
+
+		# Sentences are exported and transcribed in the background, so the ingest only decodes and cuts the audio
+		self.on_transcript: Callable[[dict], None] = on_transcript or (lambda delta: None)
+		self.exports: queue.Queue = queue.Queue()
+		self.transcriptions: TranscriptionQueue = TranscriptionQueue(transcribe_segment, self.deliver)
+		self.exporter = (start_task or start_thread)(self.export_worker)
+
+	def new_iteration(self) -> str:
+		""" Close the current iteration of the session (moving its files to a subfolder) and start a new one\n
+		Returns:
+			str: Start time of the previous iteration (empty for the first one)
+		"""
+		old_id: str = self.id
+		if old_id:
+			self.exports.join()
+			self.transcriptions.wait()
+			if KEEP_AUDIO_FILES:
+				get_archiver().close_stream(f"{old_id}_server")
+				get_archiver().wait()
+			close_the_big_transcript(old_id)
+			move_session_files(old_id)
+
+		# The id (start time and connection) is used to name every file of the session
+		self.start_time: float = time.perf_counter()
+		self.id = datetime.now().strftime("%Y-%m-%d_%H-%M-%S") + "_" + self.sid[:8]
+		return old_id
+
+	@property
+	def manifest(self) -> SegmentManifest:
+		return get_manifest(self.id)
+
+	@property
+	def volume(self) -> float:
+		""" Volume of the last decoded audio (in dBFS) """
+		return round(amplitude_to_dbfs(self.segmenter.volume), 3) if self.segmenter else -float("inf")
+
+	def reset(self) -> None:
+		""" Stop the streaming decoder and clear the buffered audio (the header of the stream is kept for the next decoder) """
+		if self.decoder is not None:
+			self.decoder.close()
+			self.decoder = None
+		self.segmenter = None
+
+	def set_mime_type(self, mime_type: str) -> None:
+		""" Change the MIME type of the incoming audio (restarting the decoder if needed) """
+		if mime_type != self.mime_type or self.pcm_mode:
+			self.reset()
+		self.header = b""
+		self.mime_type = mime_type
+		self.pcm_mode = False
+		self.resampler = None
+
+	def set_pcm_format(self, rate: int) -> None:
+		""" Switch to raw PCM ingest (16-bit mono at the given rate, no decoder needed, resampled to ANALYSIS_RATE if needed) """
+		self.reset()
+		self.header = b""
+		self.pcm_mode = True
+		self.resampler = Resampler(rate, self.rate) if rate != self.rate else None
+
+	def set_threshold(self, threshold: int) -> None:
+		""" Change the threshold for silence detection (in dB) """
+		self.threshold = threshold
+		if self.segmenter is not None:
+			self.segmenter.detector.threshold = dbfs_to_amplitude(threshold)
+
+	def ingest(self, frames: bytes) -> list[tuple[bytes, float, float]]:
+		""" Decode a chunk of the audio stream and cut the finished sentences\n
+		Args:
+			frames	(bytes):	Audio data as received from the client
+		Returns:
+			list[tuple[bytes, float, float]]: Finished sentences with their start and end time (in seconds)
+		"""
+		# Keep the header of the stream (the first chunk, or a new one if the client restarts its recorder)
+		# A WebM header is kept without its audio (up to the first cluster) so that it is not decoded twice
+		new_stream: bool = not self.header or frames.startswith(EBML_HEADER)
+		if new_stream:
+			cluster: int = frames.find(WEBM_CLUSTER) if frames.startswith(EBML_HEADER) else -1
+			self.header = frames[:cluster] if cluster > 0 else frames
+
+		# Start the decoder, giving it the header first if the chunk is in the middle of the stream (e.g. after a decoding error)
+		with metrics.timer("decode_seconds"):
+			if self.decoder is None:
+				self.decoder = StreamDecoder(self.mime_type, self.rate)
+				self.segmenter = Segmenter(self.rate, dbfs_to_amplitude(self.threshold))
+				if not new_stream:
+					self.decoder.feed(self.header)
+			self.decoder.feed(frames)
+			pcm: bytes = self.decoder.read()
+		if not pcm:
+			return []
+		with metrics.timer("segment_cut_seconds", source = "server"):
+			return self.segmenter.feed(pcm)
+
+	def ingest_pcm(self, pcm: bytes) -> list[tuple[bytes, float, float]]:
+		""" Cut the finished sentences of raw PCM sent by the client (no container parsing, no subprocess)\n
+		Args:
+			pcm	(bytes):	Audio data (16-bit mono PCM at the rate given to set_pcm_format)
+		Returns:
+			list[tuple[bytes, float, float]]: Finished sentences with their start and end time (in seconds)
+		"""
+		if self.segmenter is None:
+			self.segmenter = Segmenter(self.rate, dbfs_to_amplitude(self.threshold))
+		if self.resampler is not None:
+			pcm = self.resampler.process(pcm)
+		with metrics.timer("segment_cut_seconds", source = "server"):
+			return self.segmenter.feed(pcm)
+
+	def save(self, segments: list[tuple[bytes, float, float]]) -> None:
+		""" Queue the sentences for export and transcription (returns immediately)\n
+		Args:
+			segments	(list[tuple[bytes, float, float]]):	Sentences with their start and end time (in seconds)
+		"""
+		for segment in segments:
+			self.exports.put(segment)
+
+	def export_worker(self) -> None:
+		""" Background task registering the sentences in the manifest and sending their audio (in memory) to the transcription workers """
+		while (item := self.exports.get()) is not None:
+			pcm, start, end = item
+			try:
+				manifest: SegmentManifest = self.manifest
+				name: str = f"{self.id}_server_{manifest.count('server') + 1}"
+				audio_file: str|None = get_archiver().submit(pcm, name, self.rate, f"{self.id}_server") if KEEP_AUDIO_FILES else None
+				segment: Segment = manifest.add("server", start, end, audio_file, name, pcm = pcm, rate = self.rate)
+				metrics.increment("segments_total", source = "server")
+				metrics.increment("segment_audio_seconds_total", end - start, source = "server")
+				info(f"Sentence '{name}' ({end - start:.2f}s) sent for transcription")
+				self.transcriptions.submit(segment)
+			except Exception as e:
+				error(f"Error while exporting a sentence of the session '{self.id}': {e}", exit = False)
+			self.exports.task_done()
+
+	def deliver(self, segment: Segment, transcript: str) -> None:
+		""" Save a transcript (in order) and send the segments newly added to the big transcript """
+		save_transcript(segment, transcript)
+		segments: list[Segment] = update_the_big_transcript(segment.manifest.start_time)
+		if segments:
+			self.on_transcript(transcript_delta(segment.manifest.start_time, segments))
+
+	def close(self) -> None:
+		""" Save the sentence in progress, wait for the background tasks and release the session """
+		with self.lock:
+			if self.segmenter is not None:
+				self.save(self.segmenter.flush())
+			self.reset()
+		self.exports.put(None)
+		if self.exporter is not None:
+			self.exporter.join()
+		self.transcriptions.shutdown()
+		if KEEP_AUDIO_FILES:
+			get_archiver().close_stream(f"{self.id}_server")
+		close_the_big_transcript(self.id)
+
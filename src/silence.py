@@ -2,60 +2,74 @@
 # Imports
 from config import *
 from src.print import *
+from src.vad import VoiceActivityDetector, as_samples, amplitude_to_dbfs, dbfs_to_amplitude
 import numpy as np
-import pydub
+import wave
 import io
 
 # Silence detection function
-def is_silent(data: bytes, threshold: int = SILENCE_THRESHOLD) -> bool:
-	""" Check if the mean volume of the audio data is below the threshold\n
+def is_silent(data: bytes, threshold: int = SILENCE_THRESHOLD, rate: int = RATE) -> bool:
+	""" Check if the audio data has (almost) no voiced frame\n
 	Args:
-		data		(bytes):	Audio data
-		threshold	(int):		Threshold for silence detection
+		data		(bytes):	Audio data (16-bit mono PCM)
+		threshold	(int):		RMS amplitude threshold of a voiced frame
+		rate		(int):		Sample rate (Hz)
 	Returns:
-		bool: True if the mean volume is below the threshold, False otherwise
+		bool: True if the audio is silent, False otherwise
 	"""
 	if not data:
 		return True
+	detector: VoiceActivityDetector = VoiceActivityDetector(rate, threshold)
+	if DEBUG_VOLUME:
+		_, rms, _ = detector.analyze(data)
+		debug(f"Volume: {rms.max(initial = 0):.2f} (Threshold: {threshold})")
+	return detector.is_silent(data)
 
-	# Convert the audio data to a numpy array
-	try:
-		audio_data: np.ndarray = np.frombuffer(data, np.int16)
-	except ValueError as e:
-		warning(f"Error while converting the audio data to a numpy array: {e}")
-		return True
 
-	# Return True if the mean volume is below the threshold
-	volume: float = np.abs(audio_data).mean()
+# Silence detection for raw PCM (volumes in dBFS)
+def is_silent_pcm(data: bytes, threshold: float = -60.0, rate: int = RATE) -> tuple[bool, float]:
+	""" Check if the audio data has (almost) no frame louder than the threshold\n
+	Args:
+		data		(bytes):	Audio data (16-bit mono PCM)
+		threshold	(float):	Threshold for silence detection (in dB)
+		rate		(int):		Sample rate (Hz)
+	Returns:
+		bool: True if the audio is silent, False otherwise
+		float: The volume of the audio data (in dBFS)
+	"""
+	detector: VoiceActivityDetector = VoiceActivityDetector(rate, dbfs_to_amplitude(threshold))
+	voiced, rms, _ = detector.analyze(data)
+	if len(rms) == 0:
+		return True, -float("inf")
+
+	# Overall volume, from the energy of the frames
+	volume: float = amplitude_to_dbfs(float(np.sqrt(np.dot(rms, rms) / len(rms))))
 	if DEBUG_VOLUME:
 		debug(f"Volume: {volume:.2f} (Threshold: {threshold})")
-	return volume < threshold
+	return detector.silent(voiced), round(volume, 3)
 
 
 # Silence detection for wav files
 def is_silent_wav_bytes(data: bytes, threshold: float = -60.0) -> tuple[bool, float]:
-	""" Check if the mean volume of the audio data is below the threshold\n
+	""" Check if the audio data of a WAV file has (almost) no frame louder than the threshold\n
 	Args:
-		data		(bytes):	Audio data
+		data		(bytes):	WAV file content (16-bit)
 		threshold	(float):	Threshold for silence detection (in dB)
 	Returns:
-		bool: True if the mean volume is below the threshold, False otherwise
-		float: The mean volume of the audio data
+		bool: True if the audio is silent, False otherwise
+		float: The volume of the audio data (in dBFS)
 	"""
 	try:
 		if not data:
-			return True
-		
-		# Convert audio to pydub AudioSegment
-		audio: pydub.AudioSegment = pydub.AudioSegment.from_wav(io.BytesIO(data))
+			return True, -float("inf")
 
-		# Return True if the mean volume is below the threshold
-		volume = audio.dBFS
-		if DEBUG_VOLUME:
-			debug(f"Volume: {volume:.2f} (Threshold: {threshold})")
-		return volume < threshold, round(volume, 3)
+		# Read the samples from the WAV container (only the first channel is analyzed)
+		with wave.open(io.BytesIO(data), "rb") as wf:
+			channels: int = wf.getnchannels()
+			rate: int = wf.getframerate()
+			samples: np.ndarray = as_samples(wf.readframes(wf.getnframes()))
+		return is_silent_pcm(samples[::channels], threshold, rate)
 
 	except Exception as e:
 		warning(f"Error while detecting silence in the audio data: {e}")
 		return True, 0.0
-
@@ -0,0 +1,134 @@
+
+## Imports
+from config import *
+from src.print import *
+import numpy as np
+import threading
+import hashlib
+import json
+
+# Base class of the speech recognition backends
+class SpeechBackend:
+	name: str = "base"
+
+	@property
+	def identity(self) -> str:
+		""" Name of the backend and of its model (transcripts of different identities are cached separately) """
+		return self.name
+
+	def transcribe(self, pcm: bytes, rate: int) -> str:
+		""" Transcribe the given audio\n
+		Args:
+			pcm		(bytes):	Audio data (16-bit mono PCM)
+			rate	(int):		Sample rate (Hz)
+		Returns:
+			str: Transcript of the audio (empty if nothing was understood)
+		"""
+		raise NotImplementedError
+
+
+# Google Speech Recognition (online)
+class GoogleBackend(SpeechBackend):
+	name: str = "google"
+
+	def __init__(self):
+		import speech_recognition as sr
+		self.sr = sr
+		self.recognizer: sr.Recognizer = sr.Recognizer()
+
+	def transcribe(self, pcm: bytes, rate: int) -> str:
+		audio_data = self.sr.AudioData(bytes(pcm), rate, 2)
+		try:
+			return self.recognizer.recognize_google(audio_data, language=LANGUAGE) or ""
+		except self.sr.UnknownValueError:
+			return ""
+
+
+# Vosk (offline, Kaldi models)
+class VoskBackend(SpeechBackend):
+	name: str = "vosk"
+
+	def __init__(self):
+		import vosk
+		vosk.SetLogLevel(-1)
+		self.vosk = vosk
+		self.model = vosk.Model(VOSK_MODEL_PATH)
+
+	@property
+	def identity(self) -> str:
+		return f"{self.name}:{os.path.basename(VOSK_MODEL_PATH.rstrip('/'))}"
+
+	def transcribe(self, pcm: bytes, rate: int) -> str:
+		# A recognizer is cheap to create and cannot be shared between threads, unlike the model
+		recognizer = self.vosk.KaldiRecognizer(self.model, rate)
+		recognizer.AcceptWaveform(bytes(pcm))
+		return json.loads(recognizer.FinalResult()).get("text", "")
+
+
+# faster-whisper (offline, Whisper models running on CPU)
+class FasterWhisperBackend(SpeechBackend):
+	name: str = "faster-whisper"
+
+	def __init__(self):
+		from faster_whisper import WhisperModel
+		self.model = WhisperModel(WHISPER_MODEL, device = "cpu", compute_type = "int8", num_workers = TRANSCRIPTION_WORKERS)
+
+	@property
+	def identity(self) -> str:
+		return f"{self.name}:{WHISPER_MODEL}"
+
+	def transcribe(self, pcm: bytes, rate: int) -> str:
+		# Whisper expects float32 samples at 16 kHz
+		audio_data: np.ndarray = np.frombuffer(pcm, np.int16).astype(np.float32) / 32768
+		if rate != 16000:
+			positions: np.ndarray = np.arange(0, len(audio_data), rate / 16000)
+			audio_data = np.interp(positions, np.arange(len(audio_data)), audio_data).astype(np.float32)
+		segments, _ = self.model.transcribe(audio_data, language = LANGUAGE.split("-")[0])
+		return " ".join(segment.text.strip() for segment in segments)
+
+
+# Deterministic backend for tests and offline runs
+class FakeBackend(SpeechBackend):
+	name: str = "fake"
+
+	def transcribe(self, pcm: bytes, rate: int) -> str:
+		digest: str = hashlib.sha256(pcm).hexdigest()[:8]
+		return f"segment {digest} of {len(pcm) / (2 * rate):.2f} seconds"
+
+
+# Available backends
+BACKENDS: dict[str, type[SpeechBackend]] = {
+	backend.name: backend for backend in (GoogleBackend, VoskBackend, FasterWhisperBackend, FakeBackend)
+}
+
+# Shared backend instance (the model is loaded once per process and shared by the transcription workers)
+backend_instance: SpeechBackend|None = None
+backend_name: str = SPEECH_BACKEND
+backend_lock: threading.Lock = threading.Lock()
+def get_backend() -> SpeechBackend:
+	""" Get the speech recognition backend selected in the configuration (or with use_backend), loading it on first use\n
+	Returns:
+		SpeechBackend: The shared backend instance
+	"""
+	global backend_instance
+	with backend_lock:
+		if backend_instance is None:
+			if backend_name not in BACKENDS:
+				raise ValueError(f"Unknown speech backend '{backend_name}', available backends: {', '.join(BACKENDS)}")
+			info(f"Loading the '{backend_name}' speech recognition backend...")
+			backend_instance = BACKENDS[backend_name]()
+		return backend_instance
+
+def use_backend(name: str) -> None:
+	""" Select another speech recognition backend than the one of the configuration (loaded on first use)\n
+	Args:
+		name	(str):	Name of the backend (a key of BACKENDS)
+	"""
+	global backend_instance, backend_name
+	if name not in BACKENDS:
+		raise ValueError(f"Unknown speech backend '{name}', available backends: {', '.join(BACKENDS)}")
+	with backend_lock:
+		if name != backend_name:
+			backend_name = name
+			backend_instance = None
+
@@ -0,0 +1,141 @@
+
+## Imports
+from config import *
+from src.print import *
+from collections.abc import Iterator
+import subprocess
+import threading
+import pydub
+
+# Input formats that ffmpeg can demux from a pipe without probing
+KNOWN_FORMATS: dict[str, str] = {"webm": "webm", "ogg": "ogg", "mp4": "mp4", "mpeg": "mp3", "mp3": "mp3", "wav": "wav"}
+
+# Streaming decoder class to turn a compressed audio stream into PCM
+class StreamDecoder:
+	def __init__(self, mime_type: str = "audio/webm", rate: int = RATE):
+		""" Start a long-lived ffmpeg process decoding the incoming container to 16-bit mono PCM\n
+		Each chunk given to feed() is decoded only once, the decoded PCM is collected by a reader thread.\n
+		Args:
+			mime_type	(str):	MIME type of the incoming audio (e.g. "audio/webm;codecs=opus")
+			rate		(int):	Sample rate of the decoded PCM (Hz)
+		"""
+		self.rate: int = rate
+		self.mime_type: str = mime_type
+
+		# Prepare the ffmpeg command (the input format is forced when known to avoid probing delays)
+		container: str = mime_type.split(";")[0].split("/")[-1].strip().lower()
+		command: list[str] = [pydub.AudioSegment.converter, "-hide_banner", "-loglevel", "error", "-nostdin"]
+		if container in KNOWN_FORMATS:
+			command += ["-probesize", "32", "-analyzeduration", "0", "-f", KNOWN_FORMATS[container]]
+		command += ["-i", "pipe:0", "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(rate), "pipe:1"]
+
+		# Start the process and the reader thread
+		self.process: subprocess.Popen = subprocess.Popen(
+			command,
+			stdin = subprocess.PIPE,
+			stdout = subprocess.PIPE,
+			stderr = subprocess.DEVNULL,
+			bufsize = 0
+		)
+		self.pcm: bytearray = bytearray()
+		self.lock: threading.Lock = threading.Lock()
+		self.thread: threading.Thread = threading.Thread(target = self.reader, daemon = True)
+		self.thread.start()
+
+	def reader(self) -> None:
+		""" Read the decoded PCM from the ffmpeg process until it exits """
+		fileno: int = self.process.stdout.fileno()
+		while True:
+			data: bytes = os.read(fileno, 65536)
+			if not data:
+				break
+			with self.lock:
+				self.pcm += data
+
+	def feed(self, frames: bytes) -> None:
+		""" Send a new chunk of the compressed stream to the decoder\n
+		Args:
+			frames	(bytes):	Audio data as received from the client
+		"""
+		if self.process.poll() is not None:
+			raise RuntimeError(f"ffmpeg decoder exited with code {self.process.returncode}")
+		self.process.stdin.write(frames)
+
+	def read(self) -> bytes:
+		""" Get the PCM decoded since the last call (only whole 16-bit samples are returned)\n
+		Returns:
+			bytes: Decoded PCM (16-bit mono at self.rate)
+		"""
+		with self.lock:
+			size: int = len(self.pcm) & ~1
+			pcm: bytes = bytes(self.pcm[:size])
+			del self.pcm[:size]
+		return pcm
+
+	def finish(self, timeout: float = 5.0) -> bytes:
+		""" Close the input of the decoder, wait for it to flush and return the remaining PCM\n
+		Args:
+			timeout	(float):	Maximum time to wait for ffmpeg to exit (in seconds)
+		Returns:
+			bytes: Remaining decoded PCM
+		"""
+		self.close(timeout)
+		return self.read()
+
+	def close(self, timeout: float = 1.0) -> None:
+		""" Stop the decoder process and its reader thread\n
+		Args:
+			timeout	(float):	Maximum time to wait for ffmpeg to exit (in seconds)
+		"""
+		try:
+			self.process.stdin.close()
+			self.process.wait(timeout = timeout)
+		except Exception:
+			self.process.kill()
+		self.thread.join(timeout = timeout)
+
+
+# Function to decode a whole audio file
+def decode_file(path: str, rate: int = RATE) -> bytes:
+	""" Decode an audio file of any format supported by ffmpeg (e.g. FLAC or Opus archives)\n
+	Args:
+		path	(str):	Path of the audio file
+		rate	(int):	Sample rate of the decoded PCM (Hz)
+	Returns:
+		bytes: Decoded PCM (16-bit mono at the given rate)
+	"""
+	result: subprocess.CompletedProcess = subprocess.run(
+		[pydub.AudioSegment.converter, "-hide_banner", "-loglevel", "error", "-nostdin",
+			"-i", path, "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(rate), "pipe:1"],
+		stdout = subprocess.PIPE,
+		stderr = subprocess.PIPE,
+	)
+	if result.returncode != 0:
+		raise RuntimeError(f"ffmpeg could not decode '{os.path.basename(path)}': {result.stderr.decode(errors = 'replace').strip()}")
+	return result.stdout
+
+# Function to decode an audio file chunk by chunk
+def stream_file(path: str, rate: int = RATE, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+	""" Decode an audio file of any format supported by ffmpeg without loading it whole in memory\n
+	Args:
+		path		(str):	Path of the audio file
+		rate		(int):	Sample rate of the decoded PCM (Hz)
+		chunk_size	(int):	Size of the chunks (in bytes, even)
+	Returns:
+		Iterator[bytes]: Decoded PCM (16-bit mono at the given rate), chunk by chunk
+	"""
+	process: subprocess.Popen = subprocess.Popen(
+		[pydub.AudioSegment.converter, "-hide_banner", "-loglevel", "error", "-nostdin",
+			"-i", path, "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(rate), "pipe:1"],
+		stdout = subprocess.PIPE,
+		stderr = subprocess.DEVNULL,
+	)
+	try:
+		while data := process.stdout.read(chunk_size):
+			yield data
+		if process.wait() != 0:
+			raise RuntimeError(f"ffmpeg could not decode '{os.path.basename(path)}' (exit code {process.returncode})")
+	finally:
+		if process.poll() is None:
+			process.kill()
+		process.stdout.close()
@@ -0,0 +1,106 @@
+
+## Imports
+from config import *
+from src.print import *
+import threading
+import hashlib
+import sqlite3
+
+# TranscriptCache class to remember the transcripts of already transcribed audio
+class TranscriptCache:
+	def __init__(self, path: str = TRANSCRIPT_CACHE_PATH, max_entries: int = TRANSCRIPT_CACHE_SIZE):
+		""" Open (or create) the cache database\n
+		Transcripts are keyed by a hash of the audio, the language and the speech recognition backend,
+		so that identical audio is only transcribed once, across sessions and restarts.\n
+		Args:
+			path		(str):	Path of the SQLite database
+			max_entries	(int):	Maximum number of transcripts kept, the least recently used ones are removed
+		"""
+		self.path: str = path
+		self.max_entries: int = max_entries
+		self.lock: threading.Lock = threading.Lock()
+		self.hits: int = 0
+		self.misses: int = 0
+		os.makedirs(os.path.dirname(path) or ".", exist_ok = True)
+		self.connection: sqlite3.Connection = sqlite3.connect(path, check_same_thread = False)
+		self.connection.execute("PRAGMA journal_mode = WAL")
+		self.connection.execute("PRAGMA synchronous = NORMAL")
+		self.connection.execute("CREATE TABLE IF NOT EXISTS transcripts (key TEXT PRIMARY KEY, transcript TEXT NOT NULL, last_used REAL NOT NULL)")
+		self.connection.execute("CREATE INDEX IF NOT EXISTS transcripts_last_used ON transcripts (last_used)")
+		self.connection.commit()
+		self.size: int = self.connection.execute("SELECT COUNT(*) FROM transcripts").fetchone()[0]
+
+	@staticmethod
+	def make_key(pcm: bytes, rate: int, backend: str, language: str = LANGUAGE) -> str:
+		""" Make the key of an audio\n
+		Args:
+			pcm			(bytes):	Audio data (16-bit mono PCM)
+			rate		(int):		Sample rate (Hz)
+			backend		(str):		Identity of the speech recognition backend (see SpeechBackend.identity)
+			language	(str):		Language of the transcript
+		Returns:
+			str: The key
+		"""
+		digest: str = hashlib.sha256(pcm).hexdigest()
+		return f"{digest}:{rate}:{language}:{backend}"
+
+	def get(self, key: str) -> str|None:
+		""" Get a cached transcript (and mark it as recently used)\n
+		Args:
+			key	(str):	Key of the audio (see make_key)
+		Returns:
+			str|None: The transcript, None if the audio was never transcribed
+		"""
+		with self.lock:
+			row: tuple|None = self.connection.execute("SELECT transcript FROM transcripts WHERE key = ?", (key,)).fetchone()
+			if row is None:
+				self.misses += 1
+				return None
+			self.connection.execute("UPDATE transcripts SET last_used = ? WHERE key = ?", (time.time(), key))
+			self.connection.commit()
+			self.hits += 1
+			return row[0]
+
+	def put(self, key: str, transcript: str) -> None:
+		""" Cache a transcript, removing the least recently used ones if the cache is full\n
+		Args:
+			key			(str):	Key of the audio (see make_key)
+			transcript	(str):	Transcript of the audio
+		"""
+		with self.lock:
+			inserted: int = self.connection.execute(
+				"INSERT OR REPLACE INTO transcripts (key, transcript, last_used) VALUES (?, ?, ?)", (key, transcript, time.time())
+			).rowcount
+			self.size += inserted
+
+			# Remove a tenth of the cache at once so that the eviction cost is amortized
+			if self.size > self.max_entries:
+				excess: int = self.size - self.max_entries + self.max_entries // 10
+				self.connection.execute("DELETE FROM transcripts WHERE key IN (SELECT key FROM transcripts ORDER BY last_used LIMIT ?)", (excess,))
+				self.size = self.connection.execute("SELECT COUNT(*) FROM transcripts").fetchone()[0]
+			self.connection.commit()
+
+	def close(self) -> None:
+		""" Close the database """
+		with self.lock:
+			self.connection.close()
+
+
+# Shared cache (opened on first use)
+transcript_cache: TranscriptCache|None = None
+cache_enabled: bool = TRANSCRIPT_CACHE
+cache_lock: threading.Lock = threading.Lock()
+def get_transcript_cache() -> TranscriptCache|None:
+	""" Get the shared transcript cache\n
+	Returns:
+		TranscriptCache|None: The shared cache, None if disabled (or if the database cannot be opened)
+	"""
+	global transcript_cache, cache_enabled
+	with cache_lock:
+		if transcript_cache is None and cache_enabled:
+			try:
+				transcript_cache = TranscriptCache()
+			except (sqlite3.Error, OSError) as e:
+				warning(f"Transcript cache disabled, cannot open '{TRANSCRIPT_CACHE_PATH}': {e}")
+				cache_enabled = False
+		return transcript_cache
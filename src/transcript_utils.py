@@ -3,18 +3,48 @@
 from config import *
 from src.print import *
 #from src.open_ai import transcript_api
-import speech_recognition as sr
+from src.transcription_queue import TranscriptionQueue
+from src.speech_backends import SpeechBackend, get_backend
+from src.transcript_cache import TranscriptCache, get_transcript_cache
+from src.stream_decoder import decode_file
+from src.metrics import metrics, RATIO_BUCKETS
+from src.report import make_report, close_report
+from src.manifest import Segment, SegmentManifest, TRANSCRIBED, get_manifest, close_manifest
+import numpy as np
+import threading
+import wave
 import io
 import os
 
+# Function to read a WAV file as PCM
+def read_wav(audio_file: str|bytes) -> tuple[bytes, int]:
+	""" Read a 16-bit WAV file as mono PCM\n
+	Args:
+		audio_file (str|bytes): Path to the audio file or the audio data
+	Returns:
+		tuple[bytes, int]: Audio data (16-bit mono PCM) and its sample rate (Hz)
+	"""
+	with wave.open(audio_file if isinstance(audio_file, str) else io.BytesIO(audio_file), "rb") as wf:
+		if wf.getsampwidth() != 2:
+			raise ValueError(f"Only 16-bit audio is supported (got {8 * wf.getsampwidth()}-bit)")
+		pcm: bytes = wf.readframes(wf.getnframes())
+		if wf.getnchannels() > 1:
+			audio_data: np.ndarray = np.frombuffer(pcm, np.int16).reshape(-1, wf.getnchannels())
+			pcm = (audio_data.sum(axis = 1, dtype = np.int32) // wf.getnchannels()).astype(np.int16).tobytes()
+		return pcm, wf.getframerate()
+
 # Function to make api call
-def call_api(audio_file: str|bytes) -> str:
+def call_api(audio_file: str|bytes, rate: int|None = None, name: str|None = None) -> str:
 	""" Call the API to get the transcript of the audio file\n
 	Args:
-		audio_file (str|bytes): Path to the audio file or the audio data
+		audio_file	(str|bytes):	Path to the audio file, the WAV data, or raw PCM if the rate is given
+		rate		(int|None):		Sample rate (Hz) of the raw PCM (None if audio_file is a WAV file)
+		name		(str|None):		Name of the audio in the logs
 	Returns:
 		str: Transcript of the audio file
 	"""
+	if name is None:
+		name = os.path.basename(audio_file) if isinstance(audio_file, str) else "<memory>"
 	try:
 		if USE_OPENAI_API:
 			# Call the OpenAI API to get the transcript
@@ -22,20 +52,36 @@ def call_api(audio_file: str|bytes) -> str:
 			pass
 		else:
 			try:
-				# Call the API to get the transcript
-				recognizer: sr.Recognizer = sr.Recognizer()
-				with sr.AudioFile(audio_file if isinstance(audio_file, str) else io.BytesIO(audio_file)) as source:
-					audio_data = recognizer.record(source)
-				transcript: str = recognizer.recognize_google(audio_data, language=LANGUAGE)
-			except sr.UnknownValueError as e:
-				warning(f"Google Speech Recognition could not understand the audio file '{os.path.basename(audio_file)}': {e}")
-				return ""
+				# Call the speech recognition backend to get the transcript
+				pcm, rate = (audio_file, rate) if rate else read_wav(audio_file)
+				backend: SpeechBackend = get_backend()
+
+				# Reuse the transcript if the same audio was already transcribed
+				cache: TranscriptCache|None = get_transcript_cache()
+				key: str = TranscriptCache.make_key(pcm, rate, backend.identity) if cache else ""
+				transcript: str|None = cache.get(key) if cache else None
+				if transcript is not None:
+					metrics.increment("transcript_cache_hits_total")
+					if DEBUG_MODE:
+						debug(f"Transcript of '{name}' found in the cache")
+				else:
+					start: float = time.perf_counter()
+					transcript = backend.transcribe(pcm, rate)
+					elapsed: float = time.perf_counter() - start
+					metrics.observe("recognizer_seconds", elapsed)
+					if pcm:
+						metrics.observe("recognizer_realtime_factor", elapsed * 2 * rate / len(pcm), RATIO_BUCKETS)
+					if cache:
+						cache.put(key, transcript or "")
+				if not transcript:
+					warning(f"Speech recognition could not understand the audio file '{name}'")
+					return ""
 			except Exception as e:
-				error(f"Error while recognizing the audio file '{os.path.basename(audio_file)}': {e}", exit = False)
+				error(f"Error while recognizing the audio file '{name}': {e}", exit = False)
 				return ""
 
 	except Exception as e:
-		error(f"Error while calling the API for the audio file '{os.path.basename(audio_file)}': {e}", exit = False)
+		error(f"Error while calling the API for the audio file '{name}': {e}", exit = False)
 		return ""
 	if transcript is None:
 		return ""
@@ -49,118 +95,186 @@ def call_api(audio_file: str|bytes) -> str:
 	# Return the transcript
 	return transcript
 
-# Function to manage new audios
-def manage_new_audios(start_time: str) -> str:
-	""" Manage the new audio files in the audio folder\n
+# Function to transcribe a segment
+def transcribe_segment(segment: Segment) -> str:
+	""" Get the transcript of a segment (called from the transcription workers)\n
+	The audio is taken from memory when available, else from the audio file (e.g. when resuming a session).\n
 	Args:
-		start_time (str): Start time of the application (for the report generation)
+		segment	(Segment):	Segment to transcribe
 	Returns:
-		str: The big transcript
+		str: Transcript of the segment
 	"""
-	# Get the list of audio files ordered by creation date
-	audio_files: list[str] = [f"{AUDIO_FOLDER}/{f}" for f in os.listdir(AUDIO_FOLDER) if f.endswith(".wav")]
-	audio_files.sort(key=lambda x: os.path.getctime(x))
-
-	# Process the audio files that are not already in the list
-	for audio_file in audio_files:
-		equivalent_transcript: str = f"{TRANSCRIPT_FOLDER}/{os.path.basename(audio_file).replace('.wav', '.txt')}"
-		
-		# Check if the transcript already exists
-		if os.path.exists(equivalent_transcript):
-			continue
-
-		# Call the API to get the transcript
-		if DEBUG_MODE:
-			debug(f"Processing the audio file '{os.path.basename(audio_file)}' with the equivalent transcript '{os.path.basename(equivalent_transcript)}'")
-		transcript: str = call_api(audio_file)
-
-		# Remove the audio file if needed
-		if not KEEP_AUDIO_FILES:
-			os.remove(audio_file)
-			info(f"Audio file '{os.path.basename(audio_file)}' removed successfully!")
+	if DEBUG_MODE:
+		debug(f"Processing the segment '{segment.name}'")
+	if segment.pcm is not None:
+		return call_api(segment.pcm, segment.rate, segment.name)
+	if segment.audio_file and os.path.exists(segment.audio_file):
+		if segment.audio_file.lower().endswith(".wav"):
+			return call_api(segment.audio_file)
+		return call_api(decode_file(segment.audio_file, segment.rate), segment.rate, segment.name)
+	warning(f"No audio left for the segment '{segment.name}', skipping it")
+	return ""
+
 
-		# Save the transcript to a file
-		with open(equivalent_transcript, "w", encoding="utf-8") as f:
+# Function to save the transcript of a segment
+def save_transcript(segment: Segment, transcript: str) -> None:
+	""" Save the transcript in the manifest and next to the others, and remove the audio file if needed\n
+	Args:
+		segment		(Segment):	Transcribed segment
+		transcript	(str):		Transcript of the segment
+	"""
+	# Release the audio, and remove the audio file if needed
+	segment.pcm = None
+	if not KEEP_AUDIO_FILES and segment.audio_file and os.path.exists(segment.audio_file):
+		os.remove(segment.audio_file)
+		info(f"Audio file '{os.path.basename(segment.audio_file)}' removed successfully!")
+
+	# Save the transcript to a file
+	if KEEP_TRANSCRIPTS:
+		with open(f"{TRANSCRIPT_FOLDER}/{segment.name}.txt", "w", encoding="utf-8") as f:
 			f.write(transcript)
-		info(f"Transcript '{os.path.basename(equivalent_transcript)}' saved successfully!")
-	
-	# Make one big transcript
-	return make_the_big_transcript(start_time)
+		info(f"Transcript '{segment.name}.txt' saved successfully!")
+
+	# Save the transcript in the manifest
+	segment.manifest.set_state(segment, TRANSCRIBED, transcript)
+
+
+# Shared transcription queue (created on first use)
+transcription_queue: TranscriptionQueue|None = None
+def get_transcription_queue() -> TranscriptionQueue:
+	""" Get the shared transcription queue, transcripts are saved in the order the segments were submitted\n
+	Returns:
+		TranscriptionQueue: The shared queue
+	"""
+	global transcription_queue
+	if transcription_queue is None:
+		transcription_queue = TranscriptionQueue(transcribe_segment, save_transcript)
+	return transcription_queue
+
 
+# TranscriptIndex class to build the big transcript incrementally
+class TranscriptIndex:
+	def __init__(self, start_time: str):
+		""" Initialize the big transcript from the segments of the manifest that are already merged\n
+		Args:
+			start_time	(str):	Start time of the application (for the report generation)
+		"""
+		self.start_time: str = start_time
+		self.manifest: SegmentManifest = get_manifest(start_time)
+		self.path: str = f"{OUTPUT_FOLDER}/full_transcript_{start_time}.txt"
+		self.parts: list[str] = []				# Pieces of the big transcript
+		self.text: str = ""						# The big transcript (joined lazily)
+		self.text_parts: int = 0				# Number of parts joined in self.text
+		self.previous_type: str = ""
+
+		# Rebuild the big transcript file once (e.g. when resuming a session)
+		merged: list[Segment] = self.manifest.segments[:self.manifest.merge_cursor]
+		with open(self.path, "w", encoding="utf-8") as f:
+			f.write(self.append(merged))
+
+	def append(self, segments: list[Segment]) -> str:
+		""" Add the transcripts of the given segments to the big transcript\n
+		Args:
+			segments	(list[Segment]):	Transcribed segments, in order
+		Returns:
+			str: The text that was added
+		"""
+		new_text: str = ""
+		for segment in segments:
+
+			# Add a separator if the type of the transcript changes (recording or playback)
+			if self.previous_type != segment.source:
+				new_text += f"\n{segment.source.title()}:\n"
+				self.previous_type = segment.source
+
+			# Add the transcript to the big transcript
+			transcript: str = segment.transcript.strip()
+			if transcript:
+				new_text += transcript + "\n"
+		if new_text:
+			self.parts.append(new_text)
+		return new_text
+
+	def update(self) -> list[Segment]:
+		""" Append the newly transcribed segments to the big transcript file\n
+		Returns:
+			list[Segment]: The segments that were appended, in order
+		"""
+		segments: list[Segment] = self.manifest.to_merge()
+		if not segments:
+			return []
+		new_text: str = self.append(segments)
+		with open(self.path, "a", encoding="utf-8") as f:
+			f.write(new_text)
+		self.manifest.mark_merged(segments)
+		info(f"Big transcript 'full_transcript_{self.start_time}.txt' updated successfully!")
+		return segments
+
+	def get_text(self) -> str:
+		""" Get the whole big transcript """
+		if self.text_parts != len(self.parts):
+			self.text = "".join(self.parts)
+			self.parts = [self.text]
+			self.text_parts = 1
+		return self.text
+
+
+# Indexes of the big transcripts, by start time
+transcript_indexes: dict[str, TranscriptIndex] = {}
+index_lock: threading.Lock = threading.Lock()
+
+# Function to update the big transcript
+def update_the_big_transcript(start_time: str) -> list[Segment]:
+	""" Append the newly transcribed segments to the big transcript, without building the whole text\n
+	Args:
+		start_time	(str):	Start time of the application (for the report generation)
+	Returns:
+		list[Segment]: The segments that were appended, in order
+	"""
+	with index_lock:
+		if start_time not in transcript_indexes:
+			transcript_indexes[start_time] = TranscriptIndex(start_time)
+		with metrics.timer("transcript_merge_seconds"):
+			return transcript_indexes[start_time].update()
 
 # Function to make one big transcript
-def make_the_big_transcript(start_time: str, keep_transcripts: bool = KEEP_TRANSCRIPTS) -> str:
-	""" Make one big transcript from the audio files
+def make_the_big_transcript(start_time: str) -> str:
+	""" Append the newly transcribed segments to the big transcript
 	Args:
-		start_time			(str):	Start time of the application (for the report generation)
-		keep_transcripts	(bool):	If the transcript files should be kept
+		start_time	(str):	Start time of the application (for the report generation)
 	Returns:
 		str: The big transcript
 	"""
-	# Get the list of transcript files ordered by creation date
-	transcript_files: list[str] = [f"{TRANSCRIPT_FOLDER}/{f}" for f in os.listdir(TRANSCRIPT_FOLDER) if f.endswith(".txt")]
-	transcript_files.sort(key=lambda x: os.path.getctime(x))
-
-	# Create the big transcript
-	big_transcript: str = ""
-	previous_type: str = ""
-	for transcript_file in transcript_files:
-
-		# Get the type of the transcript (recording or playback)
-		transcript_type: str = os.path.basename(transcript_file).split("_")[0]
-
-		# Add a separator if needed
-		if previous_type != transcript_type:
-			big_transcript += f"\n{transcript_type.title()}:\n"
-			previous_type = transcript_type
-		
-		# Add the transcript to the big transcript
-		with open(transcript_file, "r", encoding="utf-8") as f:
-			transcript: str = f.read().strip()
-			if transcript:
-				big_transcript += transcript + "\n"
-		
-		# Remove the transcript file if needed
-		if not keep_transcripts:
-			os.remove(transcript_file)
-			info(f"Transcript file '{os.path.basename(transcript_file)}' removed successfully!")
-	
-	# Save the big transcript to a file
-	path: str = f"{OUTPUT_FOLDER}/full_transcript_{start_time}.txt"
-	if keep_transcripts:
-		with open(path, "w", encoding="utf-8") as f:
-			f.write(big_transcript)
-		info(f"Big transcript 'full_transcript_{start_time}.txt' saved successfully!")
-
-		# Return the big transcript
-		return big_transcript
-	
-	else:
-		# Append the big transcript to the file
-		with open(path, "a", encoding="utf-8") as f:
-			f.write(big_transcript)
-		info(f"Big transcript 'full_transcript_{start_time}.txt' appended successfully!")
+	update_the_big_transcript(start_time)
+	with index_lock:
+		index: TranscriptIndex|None = transcript_indexes.get(start_time)
+		return index.get_text() if index else ""
 
-		# Return the entire content of the file
-		with open(path, "r", encoding="utf-8") as f:
-			return f.read()
+# Function to close a session
+def close_the_big_transcript(start_time: str) -> None:
+	""" Forget the big transcript of a session and close its manifest (the files stay on the disk)\n
+	Args:
+		start_time	(str):	Start time of the session
+	"""
+	with index_lock:
+		transcript_indexes.pop(start_time, None)
+	close_report(start_time)
+	close_manifest(start_time)
 
 
 # Function to make the report
-def make_the_report(start_time: str, not_final: bool = True) -> str:
+def make_the_report(start_time: str, not_final: bool = True, keep_files: bool = False) -> str:
 	""" Make the report of the application
 	Args:
 		start_time (str): Start time of the application
 		not_final (bool): If the report is not final (if final, we delete the transcript files if needed)
+		keep_files (bool): Never delete the transcript and audio files, even for the final report (e.g. when replaying recordings)
 	Returns:
 		str: The report content
 	"""
-	# Make the big transcript
-	transcript = make_the_big_transcript(start_time)
-
-	# TODO: Use AI to summarize the transcript
-	report: str = ""
-
+	# Merge the new transcripts and summarize the parts of the meeting that changed
+	update_the_big_transcript(start_time)
+	report: str = make_report(start_time, final = not not_final)
 
 	# Save the report to a file
 	with open(f"{OUTPUT_FOLDER}/report_{start_time}.{REPORT_EXTENSION}", "w", encoding="utf-8") as f:
@@ -168,10 +282,11 @@ def make_the_report(start_time: str, not_final: bool = True) -> str:
 		info(f"Report 'report_{start_time}.{REPORT_EXTENSION}' saved successfully!")
 	
 	# Remove the transcript files if needed
-	if not not_final:
+	if not not_final and not keep_files:
 		if not KEEP_TRANSCRIPTS:
 			for f in os.listdir(TRANSCRIPT_FOLDER):
-				os.remove(f"{TRANSCRIPT_FOLDER}/{f}")
+				if f.endswith(".txt"):
+					os.remove(f"{TRANSCRIPT_FOLDER}/{f}")
 		if not KEEP_AUDIO_FILES:
 			for f in os.listdir(AUDIO_FOLDER):
 				os.remove(f"{AUDIO_FOLDER}/{f}")
@@ -0,0 +1,147 @@
+
+## Imports
+from config import *
+from src.print import *
+from src.metrics import metrics
+from src.manifest import Segment
+from concurrent.futures import ThreadPoolExecutor
+from collections.abc import Callable
+import threading
+
+# TranscriptionQueue class to transcribe audio segments in parallel while keeping their order
+class TranscriptionQueue:
+	def __init__(self, transcribe: Callable[[Segment], str], on_result: Callable[[Segment, str], None], workers: int = TRANSCRIPTION_WORKERS, max_pending: int = TRANSCRIPTION_QUEUE_SIZE):
+		""" Initialize the worker pool\n
+		Args:
+			transcribe	(Callable):	Function transcribing one segment (called from the worker threads)
+			on_result	(Callable):	Function receiving (segment, transcript), always called in submission order
+			workers		(int):		Number of segments transcribed at the same time
+			max_pending	(int):		Maximum number of segments queued or in progress (submit() waits when reached)
+		"""
+		self.transcribe: Callable[[Segment], str] = transcribe
+		self.on_result: Callable[[Segment, str], None] = on_result
+		self.workers: int = workers
+		self.max_pending: int = max_pending
+		self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = "transcription")
+		self.slots: threading.Semaphore = threading.Semaphore(max_pending)
+		self.lock: threading.Lock = threading.Lock()			# Protects the counters and the results
+		self.delivery_lock: threading.Lock = threading.Lock()	# Makes sure results are delivered one at a time
+		self.done: threading.Condition = threading.Condition(self.lock)
+
+		# Ordering state
+		self.submitted: set[Segment] = set()		# Segments submitted and not delivered yet (to avoid transcribing them twice)
+		self.next_sequence: int = 0					# Sequence number of the next submitted item
+		self.next_delivery: int = 0					# Sequence number of the next item to deliver
+		self.results: dict[int, tuple[Segment, str, float]] = {}
+
+		# Back-pressure metrics
+		self.in_flight: int = 0						# Items currently being transcribed
+		self.max_depth: int = 0						# Highest number of pending items seen
+		self.stalls: int = 0						# Number of times submit() had to wait for a free slot
+		self.total_wait: float = 0.0				# Total time spent by items waiting for a worker
+		self.total_latency: float = 0.0				# Total time between submission and delivery
+
+	@property
+	def depth(self) -> int:
+		""" Number of items submitted but not delivered yet """
+		return self.next_sequence - self.next_delivery
+
+	def submit(self, item: Segment) -> bool:
+		""" Queue a segment for transcription (waits if max_pending segments are already pending)\n
+		Args:
+			item	(Segment):	Segment to transcribe (with its audio in memory or in its audio file)
+		Returns:
+			bool: True if the segment was queued, False if it is already pending
+		"""
+		with self.lock:
+			if item in self.submitted:
+				return False
+			self.submitted.add(item)
+
+		# Wait for a free slot if the queue is full
+		if not self.slots.acquire(blocking = False):
+			with self.lock:
+				self.stalls += 1
+			warning(f"Transcription queue is full ({self.max_pending} pending items), waiting for a free slot...")
+			self.slots.acquire()
+
+		# Give the item a sequence number and send it to the pool
+		with self.lock:
+			sequence: int = self.next_sequence
+			self.next_sequence += 1
+			self.max_depth = max(self.max_depth, self.depth)
+		metrics.add("transcription_queue_depth", 1)
+		self.executor.submit(self.work, sequence, item, time.perf_counter())
+		return True
+
+	def work(self, sequence: int, item: Segment, submitted_at: float) -> None:
+		""" Transcribe one segment in a worker thread, then deliver every result that is ready in order """
+		with self.lock:
+			self.in_flight += 1
+			self.total_wait += time.perf_counter() - submitted_at
+		try:
+			transcript: str = self.transcribe(item)
+		except Exception as e:
+			error(f"Error while transcribing '{item.name}': {e}", exit = False)
+			transcript = ""
+		with self.lock:
+			self.in_flight -= 1
+			self.results[sequence] = (item, transcript, submitted_at)
+		self.deliver()
+
+	def deliver(self) -> None:
+		""" Deliver the consecutive results starting from the next expected sequence number """
+		with self.delivery_lock:
+			while True:
+				with self.lock:
+					if self.next_delivery not in self.results:
+						return
+					item, transcript, submitted_at = self.results.pop(self.next_delivery)
+				try:
+					self.on_result(item, transcript)
+				except Exception as e:
+					error(f"Error while saving the transcript of '{item.name}': {e}", exit = False)
+				latency: float = time.perf_counter() - submitted_at
+				with self.lock:
+					self.submitted.discard(item)
+					self.next_delivery += 1
+					self.total_latency += latency
+					self.done.notify_all()
+				self.slots.release()
+				metrics.add("transcription_queue_depth", -1)
+				metrics.observe("transcription_latency_seconds", latency)
+				metrics.increment("transcripts_total")
+
+	def wait(self, timeout: float|None = None) -> bool:
+		""" Wait until every submitted item has been delivered\n
+		Args:
+			timeout	(float|None):	Maximum time to wait (in seconds), None to wait forever
+		Returns:
+			bool: True if the queue is empty, False if the timeout was reached
+		"""
+		with self.lock:
+			return self.done.wait_for(lambda: self.depth == 0, timeout = timeout)
+
+	def stats(self) -> dict[str, float]:
+		""" Get the back-pressure metrics of the queue\n
+		Returns:
+			dict[str, float]: Submitted, delivered, pending and in-flight counts, maximum depth, stalls, average wait and latency
+		"""
+		with self.lock:
+			delivered: int = self.next_delivery
+			return {
+				"submitted": self.next_sequence,
+				"delivered": delivered,
+				"pending": self.depth,
+				"in_flight": self.in_flight,
+				"max_depth": self.max_depth,
+				"stalls": self.stalls,
+				"average_wait": self.total_wait / delivered if delivered else 0.0,
+				"average_latency": self.total_latency / delivered if delivered else 0.0,
+			}
+
+	def shutdown(self) -> None:
+		""" Wait for the pending items and stop the worker threads """
+		self.wait()
+		self.executor.shutdown(wait = True)
+
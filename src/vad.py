@@ -0,0 +1,86 @@
+
+## Imports
+from config import *
+import numpy as np
+
+# Conversion functions between amplitudes (16-bit scale) and dBFS
+def dbfs_to_amplitude(volume: float) -> float:
+	""" Convert a volume in dBFS to a RMS amplitude on the 16-bit scale """
+	return 32768 * 10 ** (volume / 20)
+
+def amplitude_to_dbfs(amplitude: float) -> float:
+	""" Convert a RMS amplitude on the 16-bit scale to a volume in dBFS (-inf for digital silence) """
+	return 20 * np.log10(amplitude / 32768) if amplitude > 0 else -float("inf")
+
+
+# Function to get a numpy view on audio data
+def as_samples(data: bytes|memoryview|np.ndarray) -> np.ndarray:
+	""" Get the 16-bit samples of the audio data without copying them\n
+	Args:
+		data	(bytes|memoryview|np.ndarray):	Audio data (16-bit mono PCM)
+	Returns:
+		np.ndarray: The samples
+	"""
+	if isinstance(data, np.ndarray):
+		return data
+	return np.frombuffer(data, np.int16, count = len(data) // 2)
+
+
+# VoiceActivityDetector class to decide which frames of the audio contain speech
+class VoiceActivityDetector:
+	def __init__(self, rate: int = ANALYSIS_RATE, threshold: float = SILENCE_THRESHOLD, frame_duration: float = VAD_FRAME_DURATION, max_zcr: float = VAD_MAX_ZCR):
+		""" Initialize the detector\n
+		Args:
+			rate			(int):		Sample rate (Hz)
+			threshold		(float):	Minimum RMS amplitude (16-bit scale) of a voiced frame
+			frame_duration	(float):	Duration of a frame (in seconds)
+			max_zcr			(float):	Maximum zero-crossing rate of a voiced frame (higher rates are noise)
+		"""
+		self.rate: int = rate
+		self.threshold: float = threshold
+		self.frame_size: int = max(2, int(rate * frame_duration))
+		self.max_zcr: float = max_zcr
+
+	def frames(self, samples: np.ndarray) -> np.ndarray:
+		""" Split the samples in frames (view, the incomplete last frame is ignored unless it is the only one) """
+		count: int = len(samples) // self.frame_size
+		if count == 0:
+			return samples.reshape(1, -1)
+		return samples[:count * self.frame_size].reshape(count, self.frame_size)
+
+	def analyze(self, data: bytes|memoryview|np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+		""" Compute the RMS amplitude and zero-crossing rate of each frame, and decide which frames are voiced\n
+		Args:
+			data	(bytes|memoryview|np.ndarray):	Audio data (16-bit mono PCM)
+		Returns:
+			np.ndarray: Voiced decision of each frame (bool)
+			np.ndarray: RMS amplitude of each frame
+			np.ndarray: Zero-crossing rate of each frame (between 0 and 1)
+		"""
+		samples: np.ndarray = as_samples(data)
+		if len(samples) < 2:
+			return np.zeros(0, bool), np.zeros(0), np.zeros(0)
+		frames: np.ndarray = self.frames(samples)
+
+		# Energy per frame, accumulated in float64 without converting the whole buffer (no abs, so no wrap at -32768)
+		energy: np.ndarray = np.einsum("ij,ij->i", frames, frames, dtype = np.float64)
+		rms: np.ndarray = np.sqrt(energy / frames.shape[1], out = energy)
+
+		# Zero-crossing rate per frame
+		signs: np.ndarray = np.signbit(frames)
+		zcr: np.ndarray = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis = 1) / (frames.shape[1] - 1)
+
+		# A frame is voiced if it is loud enough and not noise-like
+		voiced: np.ndarray = (rms >= self.threshold) & (zcr <= self.max_zcr)
+		return voiced, rms, zcr
+
+	@staticmethod
+	def silent(voiced: np.ndarray) -> bool:
+		""" Check if the frame decisions have less than VAD_MIN_VOICED_FRAMES voiced frames (or none if there are fewer frames) """
+		count: int = np.count_nonzero(voiced)
+		return count == 0 or count < min(VAD_MIN_VOICED_FRAMES, len(voiced))
+
+	def is_silent(self, data: bytes|memoryview|np.ndarray) -> bool:
+		""" Check if the audio data has less than VAD_MIN_VOICED_FRAMES voiced frames """
+		return self.silent(self.analyze(data)[0])
+
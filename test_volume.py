@@ -29,7 +29,7 @@ def test_volume():
     try:
         while True:
             # Get frames
-            frames: bytes = stream.get_frames()
+            frames: memoryview = stream.get_frames()
             
             # Calculate volume
             if frames: